@@ -0,0 +1,159 @@
+'''
+Rolling cross-sectional statistics of many symbols on a common time grid, e.g.
+all linear perpetuals on the 1m grid: per symbol the window log return,
+volatility, and beta and correlation to a reference (BTC by default), the
+cross-sectional rank of the window return, and per bar the dispersion of
+returns across symbols. Data is fed in chronological chunks, e.g. a day at a
+time, and only the last window of returns is kept between chunks, so memory
+scales with the window and the chunk, not the history. Within a chunk, rolling
+sums are differences of cumulative sums, so each bar costs O(1) per symbol
+regardless of the window, and symbol blocks are computed in parallel threads.
+Missing bars are nan; statistics use the bars that are there, pairwise for
+beta and correlation, and are nan with fewer than `min_periods` of them.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt, timedelta as td
+import numpy as np
+from tokodaii.data import storage, SUBS
+from tokodaii.utils import time
+
+'''
+Rolling sums over `window` rows of `x`, ending at each row after the first
+`n_tail`, which are the tail of the previous chunk.
+'''
+def _window_sums(x:np.ndarray, window:int, n_tail:int) -> np.ndarray:
+  p = np.zeros((len(x)+1,)+x.shape[1:])
+  np.cumsum(x, axis=0, out=p[1:])
+  hi = np.arange(n_tail+1, len(x)+1)
+  return p[hi]-p[np.maximum(hi-window, 0)]
+
+'''
+Cross-sectional rank of each row of `x` in [0, 1], ignoring nan.
+'''
+def cross_rank(x:np.ndarray) -> np.ndarray:
+  valid = ~np.isnan(x)
+  order = np.argsort(np.where(valid, x, np.inf), axis=1, kind='stable')
+  rank = np.empty(x.shape)
+  np.put_along_axis(rank, order, np.broadcast_to(np.arange(x.shape[1], dtype=np.float64), x.shape), axis=1)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    rank /= valid.sum(axis=1, keepdims=True)-1
+  rank[~valid] = np.nan
+  return rank
+
+'''
+The engine, for `symbols`, one of which is the `reference`, over a `window` of
+bars. Symbols are split into blocks of `block_size` for the threads.
+'''
+class Rolling():
+
+  def __init__(self, symbols:list[str], reference:str='BTCUSDT', window:int=1440, min_periods:int=None, block_size:int=64, n_threads:int=8):
+    self.symbols = list(symbols)
+    self.i_reference = self.symbols.index(reference)
+    self.window = window
+    self.min_periods = window//2 if min_periods is None else min_periods
+    self.block_size, self.n_threads = block_size, n_threads
+    # The last window of log returns, and the last closes.
+    self.tail = np.empty((0, len(self.symbols)))
+    self.last_close = np.full(len(self.symbols), np.nan)
+
+  def _block(self, r:np.ndarray, y:np.ndarray, n_tail:int) -> dict[str, np.ndarray]:
+    valid = ~np.isnan(r)
+    valid_joint = valid & ~np.isnan(y)[:, None]
+    x = np.where(valid, r, 0)
+    x_joint, y_joint = np.where(valid_joint, r, 0), np.where(valid_joint, np.nan_to_num(y)[:, None], 0)
+    sums = lambda z: _window_sums(z, self.window, n_tail)
+    n, s_x, s_xx = sums(valid.astype(np.float64)), sums(x), sums(x*x)
+    n_joint, s_xj, s_yj = sums(valid_joint.astype(np.float64)), sums(x_joint), sums(y_joint)
+    s_xxj, s_yyj, s_xy = sums(x_joint*x_joint), sums(y_joint*y_joint), sums(x_joint*y_joint)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      vol = np.sqrt(np.maximum(s_xx-s_x*s_x/n, 0)/(n-1))
+      cov = s_xy-s_xj*s_yj/n_joint
+      var_x, var_y = np.maximum(s_xxj-s_xj*s_xj/n_joint, 0), np.maximum(s_yyj-s_yj*s_yj/n_joint, 0)
+      beta = cov/var_y
+      corr = np.clip(cov/np.sqrt(var_x*var_y), -1, 1)
+    few, few_joint = n < self.min_periods, n_joint < self.min_periods
+    s_x[few], vol[few], beta[few_joint], corr[few_joint] = np.nan, np.nan, np.nan, np.nan
+    return {'window return':s_x, 'vol':vol, 'beta':beta, 'corr':corr}
+
+  '''
+  Feed a chunk of bars starting at `start_time` with `closes`, one column per
+  symbol. Returns the statistics at each bar: per symbol (2D, bars by symbols)
+  the log return, and over the window the log return, the volatility of log
+  returns, beta and correlation to the reference, and the rank of the window
+  return; and per bar (1D) the dispersion, the cross-sectional standard
+  deviation of the log returns.
+  '''
+  def update(self, start_time:np.ndarray, closes:np.ndarray) -> dict[str, np.ndarray]:
+    closes = np.asarray(closes, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      r = np.log(closes/np.concatenate([self.last_close[None], closes[:-1]]))
+    self.last_close = closes[-1]
+    n_tail = len(self.tail)
+    r_all = np.concatenate([self.tail, r])
+    y = r_all[:, self.i_reference]
+    blocks = [(i, min(i+self.block_size, len(self.symbols))) for i in range(0, len(self.symbols), self.block_size)]
+    with ThreadPoolExecutor(self.n_threads) as executor:
+      results = list(executor.map(lambda b: self._block(r_all[:, b[0]:b[1]], y, n_tail), blocks))
+    ret = {'start time':start_time, 'log return':r}
+    for col in results[0].keys(): ret[col] = np.concatenate([res[col] for res in results], axis=1)
+    ret['rank'] = cross_rank(ret['window return'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+      valid = ~np.isnan(r)
+      n = valid.sum(axis=1)
+      x = np.where(valid, r, 0)
+      mean = x.sum(axis=1)/n
+      ret['dispersion'] = np.sqrt(np.maximum((x*x).sum(axis=1)/n-mean*mean, 0)*n/(n-1))
+    self.tail = r_all[-self.window:]
+    return ret
+
+  '''
+  The pairwise correlation matrix of log returns over the last window, from the
+  bars both symbols have. nan for pairs with fewer than `min_periods` of them.
+  '''
+  def corr_matrix(self) -> np.ndarray:
+    valid = (~np.isnan(self.tail)).astype(np.float64)
+    x = np.nan_to_num(self.tail)
+    n = valid.T@valid
+    s_x = x.T@valid # sum of x_i over the bars both i and j have
+    s_xx = (x*x).T@valid
+    with np.errstate(invalid='ignore', divide='ignore'):
+      cov = x.T@x-s_x*s_x.T/n
+      var = np.maximum(s_xx-s_x*s_x/n, 0)
+      corr = np.clip(cov/np.sqrt(var*var.T), -1, 1)
+    corr[n < self.min_periods] = np.nan
+    return corr
+
+'''
+Yields, per day in [`start`, `end`), the local close prices of `symbols` on the
+grid of `step` starting at midnight, as (start times, closes, one column per
+symbol). Bars without data are nan. Days are read in parallel across symbols.
+'''
+def closes_days(exchange:str, source:str, category:str, symbols:list[str], start:dt, end:dt, step:td=td(minutes=1), n_threads:int=8):
+  step_ns = step//td(microseconds=1)*10**3
+  day = dt(start.year, start.month, start.day, tzinfo=start.tzinfo)
+  def read(symbol, day_start, day_end, grid):
+    closes = np.full(len(grid), np.nan)
+    for df in storage.read_days((SUBS[exchange][source], category, symbol), day_start, day_end, 'start time', ['close price']):
+      i = np.searchsorted(grid, df['start time'])
+      keep = (i < len(grid)) & (grid[np.minimum(i, len(grid)-1)] == df['start time'])
+      closes[i[keep]] = df['close price'][keep]
+    return closes
+  with ThreadPoolExecutor(n_threads) as executor:
+    while day < end:
+      day_start, day_end = max(day, start), min(day+td(days=1), end)
+      grid = np.arange(time.unix_ns(day), time.unix_ns(day+td(days=1)), step_ns, dtype=np.int64)
+      grid = grid[(time.unix_ns(day_start) <= grid) & (grid < time.unix_ns(day_end))]
+      if len(grid): yield grid, np.stack(list(executor.map(lambda symbol: read(symbol, day_start, day_end, grid), symbols)), axis=1)
+      day += td(days=1)
+
+'''
+Yields, per day in [`start`, `end`), the rolling statistics (see
+`Rolling.update`) of `symbols` from local kline data. The reference is added
+to the symbols if it's not among them.
+'''
+def rolling_days(exchange:str, source:str, category:str, symbols:list[str], start:dt, end:dt, reference:str='BTCUSDT', window:int=1440, min_periods:int=None, step:td=td(minutes=1), n_threads:int=8):
+  symbols = list(symbols) if reference in symbols else list(symbols)+[reference]
+  rolling = Rolling(symbols, reference, window, min_periods, n_threads=n_threads)
+  for grid, closes in closes_days(exchange, source, category, symbols, start, end, step, n_threads):
+    yield rolling.update(grid, closes)
@@ -9,24 +9,33 @@ on the IP address. So it is to be used with caution still.
 
 from collections import deque
 from time import time_ns as time_ns_
+from threading import Lock
+from bisect import bisect_right
+import atexit
 import numpy as np
 from tokodaii import PATH
+from tokodaii.utils import metrics
 
 '''
 Guards have important data that must be written at exit. We can't rely on
 their destructors to do this because Python has issues destroying objects in
 the right order at exit. So we must keep them together, and deal with this
 list on exit. Even if we manually destroy a guard, it should not be removed from
-this list.
+this list. The exit hook is registered when the first guard is constructed.
 '''
 guards = []
+_guards_by_name = {}
+_lock = Lock()
+
+def _exiter():
+  for guard in guards: guard.write()
 
 '''
-Each exchange has a guard, as defined in `tokodaii.config.config`. These should
-not be manually constructed, they are automatically constructed while an
-exchange, is imported, e.g. on importing `tokodaii.bybit`. The guard object is
-defined by its limits, which are given for each exchange in
-`tokodaii.config.config`. The guard keeps a history (implemented as a `deque`)
+Each exchange has a guard, as defined in `tokodaii.config.get()`. These should
+not be manually constructed, use `get`, which constructs each guard once, when
+it's first needed, e.g. on constructing a `tokodaii.bybit.api.API`. The guard
+object is defined by its limits, which are given for each exchange in
+`tokodaii.config.get()`. The guard keeps a history (implemented as a `deque`)
 of past requests and future reserved requests. The guard will write its history
 to local storage on exit. Requests made through guard can be reserved, or not.
 If reserved, guard can't fail, and will return some amount of time you should
@@ -34,14 +43,37 @@ wait before making the request. No 2nd check-in is needed, it is safe to make
 the request, but it must be approximately at that time, and it is assumed that
 you indeed make it. If not reserved, guard can deny a request. The intended use
 case is to reserve it, since this is overall the faster solution.
+
+For exchanges that do report limits per endpoint in their response headers, the
+guard can also work in feedback mode. Then each endpoint is limited to the
+limit the server reports per `WINDOW_S`, counted over a sliding window of the
+requests made on it, plus those the server counts that weren't made through
+the guard, e.g. by another program on the same account. Once the server
+reports the limit exceeded, requests on the endpoint back off until the
+reported reset. The static limits are only a backstop, applied without their
+tolerances.
 '''
 class Guard():
 
-  def __init__(self, name, limits):
+  # Length of the window the reported limits are per; ByBit's are per second.
+  # The sliding window is longer by the tolerance, for jitter in latency.
+  WINDOW_S = 1
+  WINDOW_TOL_S = 0.05
+
+  def __init__(self, name, limits, feedback:bool=False):
     self.name = name
     self.path = PATH/f'guard_{name}.npy'
     self.limits = sorted(limits, key=lambda d:d['time'])
     self.history = self.read() if self.exists() else self._create_deque()
+    self.feedback = feedback
+    # Per endpoint: the reported limit, the sorted times in ns of the requests
+    # in the sliding window, the number of requests of others and until when,
+    # and until when the limit is exceeded.
+    self.quotas = {}
+    self.quota_lock = Lock()
+    # Server clock minus local clock in ns, as last measured from a report.
+    self.clock_offset_ns = 0
+    if not guards: atexit.register(_exiter)
     guards.append(self)
 
   def _create_deque(self) -> deque:
@@ -66,8 +98,79 @@ class Guard():
     t_max = self.limits[-1]['time']+self.limits[-1]['time tol']
     while self.history and time_ns-self.history[-1][0] > t_max*10**9: self.history.pop()
 
-  def request(self, n_requests:int=1, reserve:bool=True) -> int:
+  def _quota(self, endpoint:str) -> dict:
+    return self.quotas.setdefault(endpoint, {'limit':None, 'times':[], 'others':0, 'others until ns':0, 'exceeded until ns':0})
+
+  '''
+  Feed back the quota of `endpoint` reported by the server, as `limit`,
+  `remaining` and `reset_ms`, and the server time `server_ms` (unix ms) if known.
+  Missing values (None) mean the response didn't report them. ByBit reports the
+  server time as the reset unless the quota is exhausted, which gives the clock
+  offset; reset times are converted to the local clock with it. An exhausted
+  quota blocks the endpoint until a reset after now.
+  '''
+  def update(self, endpoint:str, limit:int=None, remaining:int=None, reset_ms:int=None, server_ms:int=None):
+    time_ns = time_ns_()
+    with self.quota_lock:
+      if server_ms is not None: self.clock_offset_ns = server_ms*10**6-time_ns
+      elif remaining and reset_ms is not None: self.clock_offset_ns = reset_ms*10**6-time_ns
+      quota = self._quota(endpoint)
+      quota['limit'] = limit if limit is not None else quota['limit']
+      if remaining is None or quota['limit'] is None: return
+      if remaining == 0 and reset_ms is not None and (until := reset_ms*10**6-self.clock_offset_ns) > time_ns:
+        quota['exceeded until ns'] = max(quota['exceeded until ns'], until)
+      window_ns = int((self.WINDOW_S+self.WINDOW_TOL_S)*10**9)
+      own = bisect_right(quota['times'], time_ns)-bisect_right(quota['times'], time_ns-window_ns)
+      quota['others'] = max(quota['limit']-remaining-own, 0)
+      quota['others until ns'] = time_ns+window_ns
+    if metrics.enabled and remaining == 0: metrics.count(f'guard_{self.name}_exhausted')
+
+  '''
+  A request on `endpoint` was rejected for exceeding the limit, until
+  `reset_ms` (server unix ms) if known. Blocks the endpoint until the reset in
+  the local clock, but at least `WINDOW_S`, and returns that time in s.
+  '''
+  def exceeded(self, endpoint:str, reset_ms:int=None) -> float:
+    time_ns = time_ns_()
+    with self.quota_lock:
+      until = 0 if reset_ms is None else reset_ms*10**6-self.clock_offset_ns
+      if until <= time_ns: until = time_ns+self.WINDOW_S*10**9
+      quota = self._quota(endpoint)
+      quota['exceeded until ns'] = max(quota['exceeded until ns'], until)
+    return (until-time_ns)/10**9
+
+  # Wait in s for `n_requests` on `endpoint` according to its reported limit,
+  # counting them against it. Requests are counted in order.
+  def _request_quota(self, endpoint:str, n_requests:int, reserve:bool, time_ns:int) -> float:
+    window_ns = int((self.WINDOW_S+self.WINDOW_TOL_S)*10**9)
+    with self.quota_lock:
+      quota = self._quota(endpoint)
+      times = quota['times']
+      del times[:bisect_right(times, time_ns-window_ns)]
+      t = max([time_ns, quota['exceeded until ns']]+times[-1:])
+      if (limit := quota['limit']) is not None:
+        # Move on to when requests leave the window, or the others expire,
+        # until there's room.
+        while True:
+          i = bisect_right(times, t-window_ns)
+          others = quota['others'] if t < quota['others until ns'] else 0
+          if len(times)-i+others+n_requests <= limit: break
+          t_next = [times[i]+window_ns] if i < len(times) else []
+          if others: t_next.append(quota['others until ns'])
+          if not t_next: break
+          t = min(t_next)
+      wait = (t-time_ns)/10**9
+      if reserve or wait == 0: times += [t]*n_requests
+      return wait
+
+  def request(self, n_requests:int=1, reserve:bool=True, endpoint:str=None) -> int:
+    if self.feedback and endpoint is not None:
+      wait_quota = self._request_quota(endpoint, n_requests, reserve, time_ns_())
+      if wait_quota and not reserve: return wait_quota
+    else: wait_quota = 0
     self._remove_old_requests(time_ns := time_ns_())
+    # In feedback mode, the static limits are only a backstop, without tolerance.
+    tol = 0 if self.feedback else 1
     # Number of requests made during the counting process, wait time for each of
     # the limits, and which limits have been broken.
     n, wait, limit_broken = 0, [0]*len(self.limits), [False]*len(self.limits)
@@ -80,12 +183,26 @@ class Guard():
       for j in range(len(self.limits)):
         limit = self.limits[j]
         if not limit_broken[j]:
-          if n+n_requests+limit['time']*limit['count tol'] >= limit['time']*limit['count']:
-            wait[j] = limit['time']+limit['time tol']-(t0-t)/10**9
+          if n+n_requests+tol*limit['time']*limit['count tol'] >= limit['time']*limit['count']:
+            wait[j] = limit['time']+tol*limit['time tol']-(t0-t)/10**9
             limit_broken[j] = True
       # Because we're conceptually in the future, there may be requests that are
       # too old to care about, despite having removed old requests.
       if (t0-t)/10**9 > self.limits[-1]['time']+self.limits[-1]['time tol']: break
-    wait = max(wait)
+    wait = max(wait+[wait_quota])
     if reserve or wait == 0: self.history.appendleft((t0+wait, n_requests))
+    if metrics.enabled:
+      metrics.count(f'guard_{self.name}_requests', n_requests)
+      metrics.observe(f'guard_{self.name}_wait_s', wait)
     return wait
+
+'''
+Get the guard named `name`, constructing it with `limits` if it doesn't exist
+yet. Asking for `feedback` turns feedback mode on for the guard.
+'''
+def get(name:str, limits:list[dict], feedback:bool=False) -> Guard:
+  with _lock:
+    if (guard := _guards_by_name.get(name)) is None:
+      guard = _guards_by_name[name] = Guard(name, limits, feedback)
+    guard.feedback |= feedback
+  return guard
@@ -3,64 +3,121 @@ import json
 import hmac
 import requests
 import urllib3
-from tokodaii.auto.guard import Guard
-from tokodaii.config import config
+from tokodaii.auto import guard
+from tokodaii import config
+from tokodaii.utils import metrics
 
 # The requests contain no unencrypted private information, so we'll speed up
 # requests by not verifying the SSL certificate each time.
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-guards = dict(zip(['mn', 'tn'], [Guard(f'ByBit_API{a}', config['ByBit']['API']['limits']) for a in ['', '_tn']]))
+# Return code of requests rejected for the rate limit.
+RATE_LIMIT_RET_CODE = 10006
+# How long ByBit bans an IP address that exceeded the IP rate limit.
+IP_BAN_S = 600
 
 '''
 A generic ByBit API call using the guard. If allow_sleep, it will guarantee the
 request can be made and sleep if need be. (This is intended to be threaded.) If
 not allow_sleep, GET and POST will return a wait time as well as the response
-json and headers.
+json and headers. If feedback, the guard is put in feedback mode, and calibrates
+itself per endpoint with the rate limit headers ByBit returns. Requests the
+server rejects for the rate limit are retried after its reset; if not
+allow_sleep, the wait until then is returned instead.
 '''
 class API():
 
-  def __init__(self, use_testnet=False, key_secret_i=0, window_ms=5000, allow_sleep=True):
+  def __init__(self, use_testnet=False, key_secret_i=0, window_ms=5000, allow_sleep=True, feedback=False):
     if use_testnet:
       self.exchange = 'ByBit_testnet'
-      self.guard = guards['tn']
+      self.guard = guard.get('ByBit_API_tn', config.get()['ByBit']['API']['limits'], feedback)
       self.url = 'https://api-testnet.bybit.com'
     else:
       self.exchange = 'ByBit'
-      self.guard = guards['mn']
+      self.guard = guard.get('ByBit_API', config.get()['ByBit']['API']['limits'], feedback)
       self.url = 'https://api.bybit.com'
-    self.key, self.secret = config[self.exchange]['keys and secrets'][key_secret_i]
+    self.key, self.secret = config.get()[self.exchange]['keys and secrets'][key_secret_i]
     self.window_ms = window_ms
     self.allow_sleep = allow_sleep
+    # The keyed hash state and the constant headers are computed once, signing
+    # then only copies the state and hashes the message.
+    self._hmac = hmac.new(bytes(self.secret, 'utf-8'), digestmod='sha256')
+    self._sign_infix = f'{self.key}{self.window_ms}'
+    self._headers = {'X-BAPI-API-KEY':self.key, 'X-BAPI-SIGN-TYPE':'2', 'X-BAPI-RECV-WINDOW':str(self.window_ms), 'Content-Type':'application/json'}
+
+  def _sign(self, message:bytes) -> str:
+    h = self._hmac.copy()
+    h.update(message)
+    return h.hexdigest()
 
   # What form `params` is in depends on whether the request is GET or POST.
   def _authenticate(self, params:str, time_ms:int=None) -> dict:
     if time_ms is None: time_ms = time_ns()//10**6
-    sign = hmac.new(bytes(self.secret, 'utf-8'), bytes(f'{time_ms}{self.key}{self.window_ms}{params}', 'utf-8'), digestmod='sha256').hexdigest()
-    return {'X-BAPI-SIGN':str(sign), 'X-BAPI-API-KEY':self.key, 'X-BAPI-SIGN-TYPE':'2', 'X-BAPI-TIMESTAMP':str(time_ms), 'X-BAPI-RECV-WINDOW':str(self.window_ms), 'Content-Type':'application/json'}
+    headers = self._headers.copy()
+    headers['X-BAPI-SIGN'] = self._sign(bytes(f'{time_ms}{self._sign_infix}{params}', 'utf-8'))
+    headers['X-BAPI-TIMESTAMP'] = str(time_ms)
+    return headers
+
+  # Feed the rate limit headers, and the server time if in `response_json`, back
+  # to the guard.
+  def _feedback(self, endpoint:str, headers, response_json:dict=None):
+    if self.guard.feedback:
+      limit, remaining, reset_ms = (headers.get(h) for h in ('X-Bapi-Limit', 'X-Bapi-Limit-Status', 'X-Bapi-Limit-Reset-Timestamp'))
+      server_ms = None if response_json is None else response_json.get('time')
+      self.guard.update(endpoint, *(None if x is None else int(x) for x in (limit, remaining, reset_ms, server_ms)))
 
-  def _check_and_return(self, response:requests.Response):
+  '''
+  If `response` was rejected for the rate limit, the time in s to back off
+  before retrying, until the reported reset (see `Guard.exceeded`), else None.
+  A 403 is an IP ban, which ByBit lifts after `IP_BAN_S`.
+  '''
+  def _backoff(self, endpoint:str, response:requests.Response, response_json:dict) -> float:
+    if response.status_code == 403: wait = IP_BAN_S
+    elif response_json is not None and response_json['retCode'] == RATE_LIMIT_RET_CODE:
+      reset_ms = response.headers.get('X-Bapi-Limit-Reset-Timestamp')
+      wait = self.guard.exceeded(endpoint, None if reset_ms is None else int(reset_ms))
+    else: return None
+    print(f'{self.exchange}: rate limited, backing off {wait:.3f} s')
+    metrics.count('api_rate_limited')
+    return wait
+
+  def _check_and_return(self, response:requests.Response, response_json:dict):
     assert response.ok
-    response_json = response.json()
     if ret_code := response_json['retCode']:
       print(f'{self.exchange}: API return code: {ret_code}')
     assert ret_code == 0
     return (response_json, response.headers) if self.allow_sleep else (0, response_json, response.headers)
 
+  # Send with `send` through the guard, retrying after rate limit rejections.
+  def _request(self, endpoint:str, send):
+    while True:
+      if wait := self.guard.request(endpoint=endpoint):
+        if self.allow_sleep:
+          with metrics.timer('api_guard_sleep_s'): sleep(wait)
+        else: return wait, None, None
+      response = send()
+      response_json = None
+      if response.ok:
+        with metrics.timer('api_json_s'): response_json = response.json()
+      self._feedback(endpoint, response.headers, response_json)
+      if (wait := self._backoff(endpoint, response, response_json)) is None: return self._check_and_return(response, response_json)
+      if not self.allow_sleep: return wait, None, None
+      with metrics.timer('api_guard_sleep_s'): sleep(wait)
+
   def GET(self, endpoint, params=None, private=False, time_ms:int=None):
-    if wait := self.guard.request():
-      if self.allow_sleep: sleep(wait)
-      else: return wait, None, None
     params = '' if params is None else '&'.join([f'{k}={v}' for k, v in params.items()])
-    headers = self._authenticate(params, time_ms) if private else None
-    response = requests.get(self.url+endpoint+'?'+params, verify=False, headers=headers)
-    return self._check_and_return(response)
+    def send():
+      headers = self._authenticate(params, time_ms) if private else None
+      with metrics.timer('api_get_s'): response = requests.get(self.url+endpoint+'?'+params, verify=False, headers=headers)
+      metrics.count('api_get')
+      return response
+    return self._request(endpoint, send)
 
   def POST(self, endpoint, params=None, private=False, time_ms:int=None):
-    if wait := self.guard.request():
-      if self.allow_sleep: sleep(wait)
-      else: return wait, None, None
     params = json.dumps(params)
-    headers = self._authenticate(params, time_ms) if private else None
-    response = requests.post(self.url+endpoint, verify=False, headers=headers, data=params)
-    return self._check_and_return(response)
+    def send():
+      headers = self._authenticate(params, time_ms) if private else None
+      with metrics.timer('api_post_s'): response = requests.post(self.url+endpoint, verify=False, headers=headers, data=params)
+      metrics.count('api_post')
+      return response
+    return self._request(endpoint, send)
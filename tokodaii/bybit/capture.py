@@ -0,0 +1,139 @@
+'''
+Capture of raw websocket messages, so that live path code can be tested and
+benchmarked without the exchange. A capture file is append-only, a sequence of
+independently compressed blocks, each a header (`BLOCK_HEADER`: magic,
+compressed size, raw size) followed by the compressed records. A record is a
+header (`RECORD_HEADER`: receive time in unix ns, size) followed by the message
+as utf-8. Because blocks are independent, a file can be appended to by later
+captures, and a file cut short by a crash is read up to its last whole block;
+appending to it first cuts off the partial block.
+'''
+
+from queue import SimpleQueue, Empty
+from threading import Thread, Lock
+from time import time_ns, perf_counter_ns, sleep
+import atexit
+import os
+import struct
+from tokodaii.utils import metrics
+
+MAGIC = b'TKC1'
+BLOCK_HEADER = struct.Struct('<4sII')
+RECORD_HEADER = struct.Struct('<qI')
+BLOCK_BYTES = 2**20
+FLUSH_S = 1
+
+'''
+Writes messages to a capture file. `write` only timestamps the message and puts
+it on a queue, so it's cheap enough to call from the websocket thread; a
+background thread packs, compresses and writes blocks of at most `block_bytes`
+raw bytes, at least every `flush_s`. An existing file is appended to, after its
+last whole block. The writer is closed at exit, but can be closed earlier with
+`close`.
+'''
+class Writer():
+
+  def __init__(self, path, compressor:str='zstd', level:int=1, block_bytes:int=BLOCK_BYTES, flush_s:float=FLUSH_S):
+    import pyarrow as pa
+    self.path = path
+    self.codec = pa.Codec(compressor, level)
+    self.block_bytes, self.flush_s = block_bytes, flush_s
+    self.n_messages, self.n_bytes = 0, 0
+    self.queue = SimpleQueue()
+    self.lock = Lock()
+    self.closed = False
+    if os.path.exists(path): os.truncate(path, _whole_blocks_size(path))
+    self.file = open(path, 'ab')
+    self.th = Thread(target=self._run, daemon=True)
+    self.th.start()
+    atexit.register(self.close)
+
+  def write(self, message:str|bytes, time_ns_:int=None):
+    self.queue.put((time_ns() if time_ns_ is None else time_ns_, message))
+
+  def _run(self):
+    records, n_raw, t_block = [], 0, 0
+    while True:
+      try: item = self.queue.get(timeout=self.flush_s)
+      except Empty: item = ()
+      if item:
+        t, message = item
+        if isinstance(message, str): message = message.encode()
+        if not records: t_block = perf_counter_ns()
+        records += [RECORD_HEADER.pack(t, len(message)), message]
+        n_raw += RECORD_HEADER.size+len(message)
+      # None closes the writer.
+      if records and (item is None or n_raw >= self.block_bytes or perf_counter_ns()-t_block >= self.flush_s*10**9):
+        self._write_block(b''.join(records), len(records)//2)
+        records, n_raw = [], 0
+      if item is None: return
+
+  def _write_block(self, raw:bytes, n_messages:int):
+    with metrics.timer('capture_write_s'):
+      compressed = self.codec.compress(raw, asbytes=True)
+      self.file.write(BLOCK_HEADER.pack(MAGIC, len(compressed), len(raw)))
+      self.file.write(compressed)
+      self.file.flush()
+    self.n_messages += n_messages
+    self.n_bytes += BLOCK_HEADER.size+len(compressed)
+    if metrics.enabled:
+      metrics.count('capture_messages', n_messages)
+      metrics.count('capture_bytes', BLOCK_HEADER.size+len(compressed))
+
+  def close(self):
+    with self.lock:
+      if self.closed: return
+      self.closed = True
+    self.queue.put(None)
+    self.th.join()
+    self.file.close()
+    atexit.unregister(self.close)
+
+# Size in bytes of the whole blocks at the start of the capture file `path`.
+def _whole_blocks_size(path) -> int:
+  size, n_bytes = 0, os.path.getsize(path)
+  with open(path, 'rb') as file:
+    while len(header := file.read(BLOCK_HEADER.size)) == BLOCK_HEADER.size:
+      magic, n_compressed, _ = BLOCK_HEADER.unpack(header)
+      assert magic == MAGIC, f'{path} is not a capture file, or is corrupt'
+      if size+BLOCK_HEADER.size+n_compressed > n_bytes: break
+      size += BLOCK_HEADER.size+n_compressed
+      file.seek(size)
+  return size
+
+'''
+The records in the capture file `path`, as (receive time in unix ns, message),
+in order. Messages are `str`, unless not `as_str`. A partially written last
+block is ignored.
+'''
+def read(path, compressor:str='zstd', as_str:bool=True):
+  import pyarrow as pa
+  codec = pa.Codec(compressor)
+  with open(path, 'rb') as file:
+    while len(header := file.read(BLOCK_HEADER.size)) == BLOCK_HEADER.size:
+      magic, n_compressed, n_raw = BLOCK_HEADER.unpack(header)
+      assert magic == MAGIC, f'{path} is not a capture file, or is corrupt'
+      if len(compressed := file.read(n_compressed)) < n_compressed: return
+      raw = memoryview(codec.decompress(compressed, decompressed_size=n_raw, asbytes=True))
+      i = 0
+      while i < n_raw:
+        t, n = RECORD_HEADER.unpack_from(raw, i)
+        i += RECORD_HEADER.size
+        yield t, str(raw[i:i+n], 'utf-8') if as_str else bytes(raw[i:i+n])
+        i += n
+
+'''
+Feed the messages in the capture file `path` to `on_message(ws, message)`, the
+same callback `tokodaii.bybit.websocket.WebSocket` takes, with `ws` as given.
+If `pace`, messages are fed at the recorded pace, sped up by `speed`, else as
+fast as possible. Returns the number of messages.
+'''
+def replay(path, on_message, ws=None, pace:bool=False, speed:float=1.0, compressor:str='zstd') -> int:
+  n, t0, t0_replay = 0, None, None
+  for t, message in read(path, compressor):
+    if pace:
+      if t0 is None: t0, t0_replay = t, perf_counter_ns()
+      if (wait := ((t-t0)/speed-(perf_counter_ns()-t0_replay))/10**9) > 0: sleep(wait)
+    on_message(ws, message)
+    n += 1
+  return n
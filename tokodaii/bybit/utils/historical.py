@@ -3,9 +3,11 @@ Dealing with historical data from public.bybit.com.
 '''
 
 from html.parser import HTMLParser
+from io import BytesIO
+from time import perf_counter_ns
 import requests
 import numpy as np
-from tokodaii.utils import dataframe
+from tokodaii.utils import dataframe, metrics, convert
 from tokodaii.data import KLINE_SIMPLE_COLUMNS, KLINE_SIMPLE_TYPES, TRADE_COLUMNS, TRADE_TYPES, DATA_TYPES
 
 URL = 'https://public.bybit.com'
@@ -17,6 +19,11 @@ CATEGORY_COLS_KEEP = {
   'trading':['timestamp', 'side', 'size', 'price'],
   'premium_index':['start_at', 'open', 'high', 'low', 'close'],
   'spot_index':['start_at', 'open', 'high', 'low', 'close']}
+# Columns parsed straight to their final type.
+CATEGORY_DTYPES = {
+  'trading':{'size':'float32', 'price':'float32'},
+  'premium_index':{'open':'float32', 'high':'float32', 'low':'float32', 'close':'float32'},
+  'spot_index':{'open':'float32', 'high':'float32', 'low':'float32', 'close':'float32'}}
 FILENAME_EXTRA = {'trading':'', 'premium_index':'_premium_index', 'spot_index':'_index_price'}
 
 '''
@@ -25,7 +32,31 @@ included in the date. Implicit data (useless) is ignored. This data is otherwise
 unprocessed, not ready to use.
 '''
 def get(category:str, symbol:str, date:str) -> dict[str, np.ndarray]:
-  return dataframe.from_csv(f'{URL}/{category}/{symbol}/{symbol}{date}{FILENAME_EXTRA[category]}.csv.gz', usecols=CATEGORY_COLS_KEEP[category], engine='pyarrow')
+  return decode(download(category, symbol, date), category)
+
+'''
+The two halves of `get`: downloading the compressed file, which is network
+bound, and decompressing and parsing it, which is CPU bound.
+'''
+def download(category:str, symbol:str, date:str) -> bytes:
+  with metrics.timer('historical_download_s'):
+    response = requests.get(f'{URL}/{category}/{symbol}/{symbol}{date}{FILENAME_EXTRA[category]}.csv.gz')
+    response.raise_for_status()
+    return response.content
+def decode(data:bytes, category:str) -> dict[str, np.ndarray]:
+  with metrics.timer('historical_decode_s'): return dataframe.from_csv(BytesIO(data), compression='gzip', usecols=CATEGORY_COLS_KEEP[category], dtype=CATEGORY_DTYPES[category], engine='pyarrow')
+
+'''
+`decode` followed by `process`, as a single picklable function for process
+pools. Metrics recorded in pool processes don't reach the parent, so the times
+in s of both are returned with the dataframe, for the parent to record.
+'''
+def decode_and_process(data:bytes, category:str) -> tuple[dict[str, np.ndarray], float, float]:
+  t0 = perf_counter_ns()
+  df = decode(data, category)
+  t1 = perf_counter_ns()
+  process(df, category)
+  return df, (t1-t0)/10**9, (perf_counter_ns()-t1)/10**9
 
 '''
 Read the categories from public.bybit.com. This is not intended to be used to
@@ -95,23 +126,27 @@ def read_dates(category:str, symbol:str) -> list[str]:
   return dates
 
 '''
-Process historical data.
+Process historical data, in place. Each column is converted to its final type
+in a single pass; the prices are already parsed as float32 by `get`. Trade
+timestamps have at most 4 decimals, and are converted exactly to ns.
 '''
 def process(df:dict[str, np.ndarray], category:str, return_chronological=True):
+  with metrics.timer('historical_process_s'): _process(df, category, return_chronological)
+def _process(df:dict[str, np.ndarray], category:str, return_chronological):
   match DATA_TYPES['ByBit']['historical'][category]:
     case 'trade':
       time = TRADE_COLUMNS[0]
-      df['price'] *= 2*(df['side'] == 'Sell')-1
-      del df['side']
-      dataframe.rename(df, from_to=dict(zip(list(df.keys()), TRADE_COLUMNS)))
-      df[time] *= 10**3 # to ms first, due to inadequate precision
-      dataframe.as_type(df, col_type=TRADE_TYPES, copy=False)
-      df[time] *= 10**6 # to ns
+      converted = {
+        time:convert.s_to_ns(df['timestamp'], decimals=4, inplace=True),
+        'size':df['size'].astype(TRADE_TYPES['size'], copy=False),
+        'price':convert.signed(df['price'], df['side'] == 'Buy', TRADE_TYPES['price'])}
     case 'kline_simple':
       time = KLINE_SIMPLE_COLUMNS[0]
-      dataframe.rename(df, from_to=dict(zip(list(df.keys()), KLINE_SIMPLE_COLUMNS)))
-      df[time] *= 10**9 # to ns
-      dataframe.as_type(df, col_type=KLINE_SIMPLE_TYPES, copy=False)      
+      converted = {time:convert.s_to_ns(df['start_at'], inplace=True)}
+      for col_raw, col in zip(CATEGORY_COLS_KEEP[category][1:], KLINE_SIMPLE_COLUMNS[1:]):
+        converted[col] = df[col_raw].astype(KLINE_SIMPLE_TYPES[col], copy=False)
+  df.clear()
+  df |= converted
   # ByBit has changed chronology before. This dataset is large, avoid numpy manipulations.
   i = 1
   while df[time][i] == df[time][0]: i += 1
@@ -3,7 +3,7 @@ from datetime import datetime as dt, timedelta as td
 import numpy as np
 from tokodaii.bybit.api import API
 from tokodaii.bybit.utils import CANDLES_PER_CALL
-from tokodaii.utils import time, dataframe
+from tokodaii.utils import time, metrics, convert
 from tokodaii.data import KLINE_TYPES, KLINE_COLUMNS
 
 '''
@@ -16,23 +16,15 @@ def get_raw(api:API, category:str, symbol:str, dt_initial:dt) -> dict[str, np.nd
   return response['result']['list']
 
 '''
-Convert raw API kline output into a dataframe.
+Convert raw API kline output (rows of strings, possibly concatenated over
+several calls) into a processed dataframe, with the columns defined by
+`tokodaii.data.KLINE_COLUMNS` and types by `tokodaii.data.KLINE_TYPES`, in a
+single pass per column. Flips by default because the API does not return
+chronologically.
 '''
-def from_api(data) -> dict[str, np.ndarray]:
-  data = np.array(data, order='F')
-  return {col:data[:,i] for i, col in enumerate(KLINE_COLUMNS)}
-
-'''
-Process API kline data. `df` should already have the right column names, as
-defined by `tokodaii.data.KLINE_COLUMNS`, because the API does not return these
-columns, so they're assigned anyway. Flips by default because the API does not
-return chronologically.
-'''
-def process(df:dict[str, np.ndarray], flip=True):
-  dataframe.as_type(df, col_type=KLINE_TYPES, copy=False)
-  df['start time'] *= 10**6 # to ns
-  if flip:
-    for col in df.keys(): df[col] = df[col][::-1]
+def from_api(data:list[list[str]], flip=True) -> dict[str, np.ndarray]:
+  with metrics.timer('kline_api_from_api_s'):
+    return convert.rows_to_columns(data, {col:KLINE_TYPES[col] for col in KLINE_COLUMNS}, flip, scale={'start time':10**6}) # ms to ns
 
 '''
 Find the earliest date of available API kline data. ByBit's data on this is
@@ -4,27 +4,36 @@ from threading import Thread
 import json
 import hmac
 import websocket
-from tokodaii.auto.guard import Guard
-from tokodaii.config import config
+from tokodaii.auto import guard
+from tokodaii.bybit.capture import Writer
+from tokodaii import config
 
 WS_CHANNELS = ['private', 'linear', 'option', 'spot']
-guards =\
-  dict(zip(WS_CHANNELS, [Guard(f'ByBit_WS_{c}', config['ByBit']['WS']['limits']) for c in WS_CHANNELS])) |\
-  dict(zip([f'{c}_tn' for c in WS_CHANNELS], [Guard(f'ByBit_WS_{c}_tn', config['ByBit']['WS']['limits']) for c in WS_CHANNELS]))
 
 '''
 A wrapper that acts as a ByBit websocket. Doesn't deal with errors, so use
 `on_error`. For simplicity, the constructor will always wait if the guard says
 it should, so the constructor can't fail, but may sleep, in the highly unlikely
-event of a websocket limit being reached.
+event of a websocket limit being reached. If `capture` is given, a path or a
+`tokodaii.bybit.capture.Writer`, every message received is also written to it,
+with its receive time, for `tokodaii.bybit.capture.replay`.
 '''
 class WebSocket():
 
-  def __init__(self, channel, use_testnet=False, key_secret_i=0, ping_interval_s=10, ping_timeout_s=5, *args, **kwargs):
-    wait = guards[channel+('_tn' if use_testnet else '')].request()
+  def __init__(self, channel, use_testnet=False, key_secret_i=0, ping_interval_s=10, ping_timeout_s=5, *args, capture=None, **kwargs):
+    assert channel in WS_CHANNELS
+    wait = guard.get(f'ByBit_WS_{channel}{"_tn" if use_testnet else ""}', config.get()['ByBit']['WS']['limits']).request()
     if wait != 0: sleep(wait)
     self.exchange = f'ByBit{"_testnet" if use_testnet else ""}'
-    self.key, self.secret = config[self.exchange]['keys and secrets'][key_secret_i]
+    self.key, self.secret = config.get()[self.exchange]['keys and secrets'][key_secret_i]
+    self.capture = None
+    if capture is not None:
+      self.capture = capture if isinstance(capture, Writer) else Writer(capture)
+      on_message = kwargs.get('on_message')
+      def on_message_(ws, message):
+        self.capture.write(message)
+        if on_message is not None: on_message(ws, message)
+      kwargs['on_message'] = on_message_
     url = f'wss://stream{"-testnet" if use_testnet else ""}.bybit.com/v5/{"public/" if channel != "private" else ""}'
     self.ws = websocket.WebSocketApp(url=url+channel, *args, **kwargs)
     self.ws_th = Thread(target=lambda: self.ws.run_forever(ping_interval=ping_interval_s, ping_timeout=ping_timeout_s), daemon=True)
@@ -57,3 +66,10 @@ class WebSocket():
 
   def unsubscribe(self, topics:dict) -> int:
     return self._send('unsubscribe', topics)
+
+  '''
+  Close the websocket, and the capture if any.
+  '''
+  def close(self):
+    self.ws.close()
+    if self.capture is not None: self.capture.close()
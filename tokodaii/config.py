@@ -5,15 +5,46 @@ guarantee safety when guard limits are tightened.
 
 import os
 import json
+from threading import Lock
 import tokodaii
 
 PATH = tokodaii.PATH/'config'
 
 DEFAULT_BYBIT_API_LIMITS = [{'time':5, 'time tol':.5, 'count':120, 'count tol':10}]
 DEFAULT_BYBIT_WS_LIMITS = [{'time':5*60, 'time tol':30, 'count':500, 'count tol':50}]
+# Per data type storage processing, see `tokodaii.data.encoding`. Each entry can
+# also override 'compressor' and 'compression level'. Columns without an
+# encoding are stored plain. `tokodaii.scripts.bench_codec` can tune these.
+DEFAULT_DATA_TYPE_PROCESSING = {
+  'kline':{'encodings':{'start time':'step', 'open price':'xor shuffle', 'high price':'xor shuffle', 'low price':'xor shuffle', 'close price':'xor shuffle', 'volume':'shuffle', 'turnover':'shuffle'}},
+  'kline_simple':{'encodings':{'start time':'step', 'open price':'xor shuffle', 'high price':'xor shuffle', 'low price':'xor shuffle', 'close price':'xor shuffle'}},
+  'kline_earliest':{'encodings':{'symbol':'dict'}},
+  'trade':{'encodings':{'time':'delta', 'size':'dict', 'price':'xor shuffle'}}}
 
-# This is initialized in `tokodaii.__init__`.
-config:dict = None
+# Initialized on the first call to `get`.
+_config:dict = None
+_lock = Lock()
+
+'''
+The config, read from local storage on first use, or created with the defaults
+if there is none yet.
+'''
+def get() -> dict:
+  global _config
+  if _config is None:
+    with _lock:
+      if _config is None:
+        if exists(): _config = read()
+        else:
+          os.makedirs(tokodaii.PATH, exist_ok=True)
+          _config = default()
+          write(_config)
+  return _config
+
+# `tokodaii.config.config` still works, it's the same as `get()`.
+def __getattr__(name:str):
+  if name == 'config': return get()
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 def exists() -> bool:
   return os.path.isfile(PATH)
@@ -33,5 +64,5 @@ def default() -> dict:
     ret[e]['WS']['limits'] = DEFAULT_BYBIT_WS_LIMITS
   ret['data'] = {
     'storage path':str(tokodaii.PATH/'storage'),
-    'processing':{'compressor':'zstd', 'compression level':1}}
+    'processing':{'compressor':'zstd', 'compression level':1, 'data types':DEFAULT_DATA_TYPE_PROCESSING}}
   return ret
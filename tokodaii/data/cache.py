@@ -0,0 +1,94 @@
+'''
+A shared in-process cache of decoded files, so that repeated reads of the same
+day files, e.g. overlapping `kline.get` ranges in backtest sweeps or plotting
+sessions, are served from memory instead of being decompressed again. It's an
+LRU cache keyed by (path, modification time), so rewritten files are read
+again, with a budget in bytes. It's thread-safe. Cached arrays are read-only;
+every hit returns a new dict, so columns can be replaced but not modified in
+place.
+'''
+
+from collections import OrderedDict
+from threading import Lock
+import os
+import numpy as np
+from tokodaii.utils import metrics
+
+BUDGET_BYTES = 2**30
+
+class Cache():
+
+  def __init__(self, budget_bytes:int=BUDGET_BYTES):
+    self.budget_bytes = budget_bytes
+    self.entries = OrderedDict() # (path, mtime ns) -> [dataframe, bytes, complete]
+    self.keys = {} # path -> (path, mtime ns), the cached version of each path
+    self.n_bytes = 0
+    self.hits, self.misses, self.evictions = 0, 0, 0
+    self.lock = Lock()
+
+  '''
+  The dataframe in `filename`, or only its `columns`, from the cache, or else
+  read with `read(filename, columns)` and cached. Columns are cached as they're
+  read, so a read of other columns of a cached file only reads those. Files
+  larger than the whole budget are not cached.
+  '''
+  def get(self, filename, read, columns:list[str]=None) -> dict[str, np.ndarray]:
+    path = str(filename)
+    key = (path, os.stat(path).st_mtime_ns)
+    with self.lock:
+      entry = self.entries.get(key) # [dataframe, bytes, whether it has all columns]
+      if entry is not None and (entry[2] if columns is None else all(col in entry[0] for col in columns)):
+        self.entries.move_to_end(key)
+        self.hits += 1
+        metrics.count('cache_hit')
+        return dict(entry[0]) if columns is None else {col:entry[0][col] for col in columns}
+      missing = None if columns is None or entry is None else [col for col in columns if col not in entry[0]]
+      self.misses += 1
+    metrics.count('cache_miss')
+    # Read outside the lock, so concurrent misses on other files don't wait.
+    df = read(filename, columns if missing is None else missing)
+    for x in df.values(): x.setflags(write=False)
+    with self.lock:
+      if (entry := self.entries.get(key)) is None:
+        if (old := self.keys.get(path)) is not None: self._remove(old)
+        entry = self.entries[key] = [{}, 0, False]
+        self.keys[path] = key
+      new = {col:x for col, x in df.items() if col not in entry[0]}
+      entry[0] |= new
+      entry[1] += (n_bytes := sum(x.nbytes for x in new.values()))
+      entry[2] |= columns is None
+      self.n_bytes += n_bytes
+      self.entries.move_to_end(key)
+      cached = dict(entry[0])
+      if entry[1] > self.budget_bytes: self._remove(key)
+      self._evict()
+    return df if columns is None else {col:(df[col] if col in df else cached[col]) for col in columns}
+
+  def _remove(self, key:tuple):
+    _, n_bytes, _ = self.entries.pop(key)
+    del self.keys[key[0]]
+    self.n_bytes -= n_bytes
+
+  def _evict(self):
+    while self.n_bytes > self.budget_bytes:
+      self._remove(next(iter(self.entries)))
+      self.evictions += 1
+      metrics.count('cache_eviction')
+
+  def set_budget(self, budget_bytes:int):
+    with self.lock:
+      self.budget_bytes = budget_bytes
+      self._evict()
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.keys.clear()
+      self.n_bytes = 0
+
+  def stats(self) -> dict:
+    with self.lock:
+      return {'hits':self.hits, 'misses':self.misses, 'evictions':self.evictions, 'entries':len(self.entries), 'bytes':self.n_bytes, 'budget bytes':self.budget_bytes}
+
+# The shared cache, used by `tokodaii.data.storage.read_feather`.
+shared = Cache()
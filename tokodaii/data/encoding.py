@@ -0,0 +1,121 @@
+'''
+Per column encodings applied before compression, to make local data smaller and
+faster to read. The encodings are lossless, and described in the schema
+metadata of each file, so files without it (written before encodings existed)
+are read as they are. Available encodings, which can be chained with spaces,
+e.g. 'xor shuffle':
+- 'plain': as is.
+- 'step': integers with a constant step, e.g. the start times of kline, stored
+  as just a base and a step; nothing is written for the column. Falls back to
+  'delta' if the step isn't constant.
+- 'delta': integers as differences, in the narrowest integer type that fits.
+- 'xor': floats as the xor of their bits with the previous value's, so that
+  repeated and slowly changing values have mostly zero bits.
+- 'shuffle': byte shuffle, all first bytes, then all second bytes, etc.
+- 'dict': dictionary encoding, for few distinct values, e.g. symbols.
+'''
+
+from typing import Any
+import json
+import numpy as np
+
+METADATA_KEY = b'tokodaii encoding'
+ENCODINGS = ['plain', 'step', 'delta', 'xor', 'shuffle', 'dict']
+
+def _narrow(x:np.ndarray) -> np.ndarray:
+  lo, hi = (int(x.min()), int(x.max())) if len(x) else (0, 0)
+  for type_ in (np.int8, np.int16, np.int32):
+    info = np.iinfo(type_)
+    if info.min <= lo and hi <= info.max: return x.astype(type_)
+  return x
+
+def _uint(dtype:np.dtype) -> np.dtype:
+  return np.dtype(f'uint{8*dtype.itemsize}')
+
+'''
+Encode a column. Returns the array to store (None if nothing needs to be
+stored), and the metadata needed to decode it.
+'''
+def encode_column(x:np.ndarray, encoding:str) -> tuple[Any, dict]:
+  meta = {'dtype':x.dtype.str if x.dtype != object else 'object', 'encoding':[]}
+  x0 = x
+  for e in encoding.split():
+    match e:
+      case 'plain': pass
+      case 'step':
+        d = np.diff(x)
+        if len(d) == 0 or (d == d[0]).all():
+          meta['encoding'].append({'name':'step', 'base':int(x[0]) if len(x) else 0, 'step':int(d[0]) if len(d) else 0})
+          x = None
+        else: return encode_column(x0, encoding.replace('step', 'delta'))
+      case 'delta':
+        meta['encoding'].append({'name':'delta', 'base':int(x[0]) if len(x) else 0})
+        x = _narrow(np.diff(x.astype(np.int64), prepend=x[:1].astype(np.int64)))
+      case 'xor':
+        bits = np.ascontiguousarray(x).view(_uint(x.dtype))
+        x = bits.copy()
+        x[1:] ^= bits[:-1]
+        meta['encoding'].append({'name':'xor'})
+      case 'shuffle':
+        width = x.dtype.itemsize
+        x = np.ascontiguousarray(x).view(np.uint8).reshape((len(x), width)).T.copy().reshape(-1).view(_uint(x.dtype))
+        meta['encoding'].append({'name':'shuffle'})
+      case 'dict':
+        import pyarrow as pa
+        x = pa.array(x).dictionary_encode()
+        meta['encoding'].append({'name':'dict'})
+      case _: raise ValueError(f'unknown encoding {e}')
+  return x, meta
+
+'''
+Decode a column stored as `x`, which is None for columns that weren't stored,
+given its metadata and the number of rows `n`.
+'''
+def decode_column(x, meta:dict, n:int) -> np.ndarray:
+  dtype = np.dtype(meta['dtype'])
+  for e in reversed(meta['encoding']):
+    match e['name']:
+      case 'step': x = e['base']+e['step']*np.arange(n, dtype=np.int64)
+      case 'delta':
+        x = np.cumsum(x, dtype=np.int64)
+        x += e['base']
+      case 'xor': x = np.bitwise_xor.accumulate(x)
+      case 'shuffle':
+        x = x.view(np.uint8).reshape((x.dtype.itemsize, n)).T.copy().view(x.dtype).reshape(n)
+      case 'dict': x = x.dictionary_decode().to_numpy(zero_copy_only=False)
+  return x.view(dtype) if dtype.kind in 'fiu' and x.dtype.itemsize == dtype.itemsize else x.astype(dtype, copy=False)
+
+'''
+Encode a dataframe into a `pyarrow.Table`, with `encodings` per column (plain
+where not given), and the metadata in the schema.
+'''
+def encode(df:dict[str, Any], encodings:dict[str, str]={}) -> 'pyarrow.Table':
+  import pyarrow as pa
+  n = len(next(iter(df.values()))) if df else 0
+  arrays, metas = {}, []
+  for col in df.keys():
+    x, meta = encode_column(np.asarray(df[col]), encodings.get(col, 'plain'))
+    metas.append({'name':col}|meta)
+    if x is not None: arrays[col] = x
+  metadata = {METADATA_KEY:json.dumps({'version':1, 'n':n, 'columns':metas})}
+  return pa.table(arrays, metadata=metadata) if arrays else pa.table({'': pa.nulls(n)}, metadata=metadata)
+
+'''
+Decode a `pyarrow.Table` written by `encode`, or a plain one. If `columns` is
+given, only those are returned, in that order.
+'''
+def decode(table:'pyarrow.Table', columns:list[str]=None) -> dict[str, np.ndarray]:
+  metadata = table.schema.metadata or {}
+  if METADATA_KEY not in metadata:
+    cols = columns or table.column_names
+    return {col:table.column(col).to_numpy() for col in cols}
+  metadata = json.loads(metadata[METADATA_KEY])
+  metas = {meta['name']:meta for meta in metadata['columns']}
+  ret = {}
+  for col in columns or list(metas.keys()):
+    x = None
+    if col in table.column_names:
+      x = table.column(col)
+      x = x.combine_chunks() if any(e['name'] == 'dict' for e in metas[col]['encoding']) else x.to_numpy()
+    ret[col] = decode_column(x, metas[col], metadata['n'])
+  return ret
@@ -1,17 +1,27 @@
 '''
 Deals with local storage for dataframes, defining how they are stored. They're
-all stored in compressed feather files.
+all stored in compressed feather files, with per column encodings depending on
+the data type, see `tokodaii.data.encoding`.
 '''
 
 from typing import Any
 import os
 from pathlib import Path
+from datetime import datetime as dt, timedelta as td
 import numpy as np
-from tokodaii.config import config
-from tokodaii.utils import dataframe
+from tokodaii import config
+from tokodaii.data import encoding, cache, KLINE_COLUMNS, KLINE_SIMPLE_COLUMNS, KLINE_EARLIEST_COLUMNS, TRADE_COLUMNS
+from tokodaii.utils import dataframe, metrics, time
+
+# Data types are recognized by their columns.
+COLUMNS_DATA_TYPES = {
+  tuple(KLINE_COLUMNS):'kline',
+  tuple(KLINE_SIMPLE_COLUMNS):'kline_simple',
+  tuple(KLINE_EARLIEST_COLUMNS):'kline_earliest',
+  tuple(TRADE_COLUMNS):'trade'}
 
 def path(*args) -> Path:
-  return Path(config['data']['storage path'], *args)
+  return Path(config.get()['data']['storage path'], *args)
 
 '''
 Read filenames. If `fmt` is specified, only read filenames of that filetype. The
@@ -29,9 +39,57 @@ def read_folders(path:Path) -> list[str]:
     return sorted([a.name for a in os.scandir(path) if a.is_dir()])
   else: return []
 
-def write_feather(filename:Path, df:dict[str, Any]):
+'''
+The processing settings for `data_type`: the compressor, compression level, and
+encodings. The global settings in the config apply where the data type has none.
+'''
+def processing(data_type:str=None) -> dict:
+  processing = config.get()['data']['processing']
+  data_types = processing.get('data types', config.DEFAULT_DATA_TYPE_PROCESSING)
+  return {'compressor':processing['compressor'], 'compression level':processing['compression level'], 'encodings':{}} | data_types.get(data_type, {})
+
+'''
+Write a dataframe. If `data_type` is not given, it's recognized by the columns,
+and if it's unknown, all columns are stored plain.
+'''
+def write_feather(filename:Path, df:dict[str, Any], data_type:str=None):
+  import pyarrow.feather as feather
   os.makedirs(filename.parent, exist_ok=True)
-  dataframe.to_feather(filename, df, version=2, compression=config['data']['processing']['compressor'], compression_level=config['data']['processing']['compression level'])
+  settings = processing(data_type or COLUMNS_DATA_TYPES.get(tuple(df.keys())))
+  with metrics.timer('storage_write_s'):
+    table = encoding.encode(df, settings['encodings'])
+    feather.write_feather(table, filename, version=2, compression=settings['compressor'], compression_level=settings['compression level'])
 
-def read_feather(filename:Path, *args, **kwargs) -> dict[str, np.ndarray]:
-  return dataframe.from_feather(filename, *args, **kwargs)
+'''
+Read a dataframe, only the `columns` given are read and decoded. Files are
+served from the shared cache in `tokodaii.data.cache` by default, then the
+arrays are read-only. Not with other arguments for `pyarrow.feather.read_table`.
+'''
+def read_feather(filename:Path, columns:list[str]=None, cached:bool=True, **kwargs) -> dict[str, np.ndarray]:
+  if cached and not kwargs: return cache.shared.get(filename, _read_feather, columns)
+  return _read_feather(filename, columns, **kwargs)
+
+def _read_feather(filename:Path, columns:list[str]=None, **kwargs) -> dict[str, np.ndarray]:
+  import pyarrow.feather as feather
+  with metrics.timer('storage_read_s'):
+    if columns is not None:
+      import pyarrow as pa
+      with pa.OSFile(str(filename)) as fp: names = pa.ipc.open_file(fp).schema.names
+      kwargs['columns'] = [col for col in columns if col in names]
+    return encoding.decode(feather.read_table(filename, **kwargs), columns)
+
+'''
+Yields the rows of the day files (named by date) in the folder `path(*sub)`
+with `on` in [`start`, `end`), one day at a time. Days without a file are
+skipped. If `columns` is given, only those are read, plus `on`. Streams usually
+pass over each file once, so files aren't cached, unless `cached`.
+'''
+def read_days(sub:tuple, start:dt, end:dt, on:str, columns:list[str]=None, cached:bool=False):
+  if columns is not None and on not in columns: columns = [on]+list(columns)
+  start_ns, end_ns = time.unix_ns(start), time.unix_ns(end)
+  n_days = ((end-td(microseconds=1)).date()-start.date()).days+1
+  for date in (start.date()+td(days=i) for i in range(n_days)):
+    filename = path(*sub, f'{date}.fea')
+    if not filename.is_file(): continue
+    df = read_feather(filename, columns, cached)
+    yield dataframe.cut(df, np.searchsorted(df[on], start_ns, side='left'), np.searchsorted(df[on], end_ns, side='left'))
@@ -0,0 +1,48 @@
+'''
+Align local data from different sources on a common time grid, without going
+through pandas. Data is streamed day file by day file and joined with the
+as-of kernels in `tokodaii.utils.dataframe`.
+'''
+
+from datetime import datetime as dt
+import numpy as np
+from tokodaii.data.utils import kline
+from tokodaii.utils import dataframe
+
+'''
+Yields, per day, the API kline close price of `symbol` in `category` with the
+last known historical spot index and premium index closes as of each bar, and
+the basis (close over index, minus 1). Bars before any index data get nan.
+'''
+def basis_days(exchange:str, category:str, symbol:str, start:dt, end:dt, tolerance:int=None):
+  bars = kline.get_days(exchange, 'API_kline', category, symbol, start, end, columns=['close price'])
+  index = kline.get_days(exchange, 'historical', 'spot_index', symbol, start, end, columns=['close price'])
+  premium = kline.get_days(exchange, 'historical', 'premium_index', symbol, start, end, columns=['close price'])
+  joined = dataframe.asof_join_chunks(bars, index, tolerance=tolerance, suffix=' index')
+  joined = dataframe.asof_join_chunks(joined, premium, tolerance=tolerance, suffix=' premium')
+  for df in joined:
+    ret = {'start time':df['start time'], 'close price':df['close price']}
+    ret['index price'] = df.get('close price index', np.full(len(ret['start time']), np.nan, dtype=np.float32))
+    ret['premium index'] = df.get('close price premium', np.full(len(ret['start time']), np.nan, dtype=np.float32))
+    ret['basis'] = ret['close price'].astype(np.float64)/ret['index price']-1
+    yield ret
+
+'''
+Like `basis_days`, concatenated over [`start`, `end`).
+'''
+def basis(exchange:str, category:str, symbol:str, start:dt, end:dt, tolerance:int=None) -> dict[str, np.ndarray]:
+  dfs = list(basis_days(exchange, category, symbol, start, end, tolerance))
+  return dataframe.concat(dfs) if dfs else {}
+
+'''
+Range join of trades onto bars starting at `starts` and lasting `step_ns`: the
+number of trades, the traded size, the signed size (positive for sells, as in
+the price sign convention), and the volume weighted absolute price per bar.
+'''
+def trades_per_bar(starts:np.ndarray, step_ns:int, trades:dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+  lo, hi = dataframe.range_indices(trades['time'], starts, starts+step_ns)
+  size, price = trades['size'], trades['price']
+  volume = dataframe.range_sum(size, lo, hi)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    vwap = dataframe.range_sum(size*np.abs(price), lo, hi)/volume
+  return {'start time':starts, 'count':hi-lo, 'volume':volume, 'signed volume':dataframe.range_sum(size*np.sign(price), lo, hi), 'vwap':vwap}
@@ -45,3 +45,11 @@ def get(exchange:str, source:str, category:str, symbol:str, start:dt, end:dt, st
     df['high price'] = df['high price'][:n_new*scale].reshape((n_new, scale)).max(axis=1)
     df['low price'] = df['low price'][:n_new*scale].reshape((n_new, scale)).min(axis=1)
     return df
+
+'''
+Yields local kline data in [`start`, `end`) one day file at a time, so long
+ranges can be streamed in bounded memory. Days without a local file are
+skipped. If `columns` is given, only those are read, plus 'start time'.
+'''
+def get_days(exchange:str, source:str, category:str, symbol:str, start:dt, end:dt, columns:list[str]=None):
+  return storage.read_days((SUBS[exchange][source], category, symbol), start, end, 'start time', columns)
@@ -0,0 +1,23 @@
+'''
+Deal with local trade data.
+'''
+
+from datetime import datetime as dt
+import numpy as np
+from tokodaii.data import storage, SUBS
+from tokodaii.utils import dataframe
+
+'''
+Yields local trade data in [`start`, `end`) one day file at a time. Days
+without a local file are skipped. If `columns` is given, only those are read,
+plus 'time'.
+'''
+def get_days(exchange:str, symbol:str, start:dt, end:dt, columns:list[str]=None):
+  return storage.read_days((SUBS[exchange]['historical'], 'trading', symbol), start, end, 'time', columns)
+
+'''
+Returns local trade data in [`start`, `end`). A single day can have millions of
+trades, prefer `get_days` for long ranges.
+'''
+def get(exchange:str, symbol:str, start:dt, end:dt, columns:list[str]=None) -> dict[str, np.ndarray]:
+  return dataframe.concat(list(get_days(exchange, symbol, start, end, columns)))
@@ -0,0 +1,100 @@
+'''
+Benchmark column encodings and compressors on local data, and pick the best
+settings per data type. For each data type, a sample of day files is read.
+Each column gets the smallest encoding whose read time is within a factor of
+the fastest encoding's, and then the data type gets the smallest compressor and
+level whose read time is within that factor of the fastest compressor's. With --w the result is written to the config, which
+`tokodaii.data.storage.write_feather` uses from then on.
+'''
+
+import argparse
+from time import perf_counter_ns
+import numpy as np
+from tokodaii import config
+from tokodaii.data import storage, encoding, SUBS, DATA_TYPES
+
+CANDIDATE_ENCODINGS = {
+  'i':['plain', 'step', 'delta'],
+  'u':['plain', 'delta'],
+  'f':['plain', 'shuffle', 'xor', 'xor shuffle', 'dict'],
+  'O':['plain', 'dict']}
+CANDIDATE_COMPRESSORS = [('lz4', None), ('zstd', 1), ('zstd', 3), ('zstd', 6), ('zstd', 9)]
+# Read times are the fastest of this many reads.
+REPEATS = 5
+
+def args():
+  parser = argparse.ArgumentParser(prog='bench_codec', description='Benchmark and pick storage encodings and compressors per data type.')
+  parser.add_argument('--n', type=int, default=8, help='number of sample files per data type (default: 8)')
+  parser.add_argument('--t', type=float, default=1.5, help='allowed read time factor over the fastest encoding and compressor (default: 1.5)')
+  parser.add_argument('--w', action=argparse.BooleanOptionalAction, default=False, help='write the results to the config')
+  return parser.parse_args()
+
+'''
+Up to `n` day files of each data type, spread over the symbols.
+'''
+def sample_files(n:int) -> dict[str, list]:
+  files = {}
+  for exchange in DATA_TYPES.keys():
+    for source in DATA_TYPES[exchange].keys():
+      for category, data_type in DATA_TYPES[exchange][source].items():
+        for symbol in storage.read_folders(storage.path(SUBS[exchange][source], category)):
+          dates = storage.read_filenames(storage.path(SUBS[exchange][source], category, symbol), fmt='fea')
+          if dates: files.setdefault(data_type, []).append(storage.path(SUBS[exchange][source], category, symbol, f'{dates[-1]}.fea'))
+  return {data_type:paths[::max(len(paths)//n, 1)][:n] for data_type, paths in files.items()}
+
+'''
+Size in bytes and read (including decode) time in s of `dfs` with `encodings`
+and the compressor. The read time is the fastest of `REPEATS`.
+'''
+def measure(dfs:list[dict], encodings:dict[str, str], compressor:str, level:int) -> tuple[int, float]:
+  import pyarrow as pa
+  import pyarrow.feather as feather
+  size, t = 0, 0
+  for df in dfs:
+    sink = pa.BufferOutputStream()
+    feather.write_feather(encoding.encode(df, encodings), sink, version=2, compression=compressor, compression_level=level)
+    buffer = sink.getvalue()
+    size += buffer.size
+    ts = []
+    for _ in range(REPEATS):
+      t0 = perf_counter_ns()
+      encoding.decode(feather.read_table(pa.BufferReader(buffer)))
+      ts.append((perf_counter_ns()-t0)/10**9)
+    t += min(ts)
+  return size, t
+
+'''
+The smallest of `results`, candidate -> (size, read time), with a read time
+within `time_factor` of the fastest.
+'''
+def pick(results:dict, time_factor:float):
+  t_min = min(t for _, t in results.values())
+  return min((c for c, (_, t) in results.items() if t <= time_factor*t_min), key=lambda c:results[c][0])
+
+def bench(dfs:list[dict], time_factor:float) -> tuple[dict, int, int]:
+  encodings = {}
+  for col, x in dfs[0].items():
+    results = {e:measure([{col:df[col]} for df in dfs], {col:e}, 'zstd', 1) for e in CANDIDATE_ENCODINGS[np.asarray(x).dtype.kind]}
+    encodings[col] = pick(results, time_factor)
+    print(f'  {col}: '+', '.join(f'{e} {s} B {t*10**3:.1f} ms' for e, (s, t) in results.items())+f' -> {encodings[col]}')
+  results = {c:measure(dfs, encodings, *c) for c in CANDIDATE_COMPRESSORS}
+  for (compressor, level), (size, t) in results.items(): print(f'  {compressor} {level}: {size} B, {t*10**3:.1f} ms')
+  compressor, level = pick(results, time_factor)
+  settings = storage.processing()
+  plain = measure(dfs, {}, settings['compressor'], settings['compression level'])[0]
+  return {'compressor':compressor, 'compression level':level, 'encodings':encodings}, results[(compressor, level)][0], plain
+
+if __name__ == '__main__':
+
+  args = args()
+  best = {}
+  for data_type, paths in sample_files(args.n).items():
+    print(f'{data_type} ({len(paths)} file(s))')
+    dfs = [storage.read_feather(path) for path in paths]
+    best[data_type], size, plain = bench(dfs, args.t)
+    print(f'  best {best[data_type]["compressor"]} {best[data_type]["compression level"]}, {size} B vs {plain} B plain')
+  if args.w:
+    config_ = config.get()
+    config_['data']['processing']['data types'] = config_['data']['processing'].get('data types', config.DEFAULT_DATA_TYPE_PROCESSING) | best
+    config.write(config_)
+    print('written to config')
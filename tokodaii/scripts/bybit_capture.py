@@ -0,0 +1,47 @@
+'''
+Capture the raw messages of ByBit websocket topics to a file, for
+`tokodaii.bybit.capture.replay`. Topics are a topic prefix and symbols, e.g.
+`publicTrade BTCUSDT ETHUSDT`, or `tickers all` for all symbols of the channel.
+'''
+
+import argparse
+from time import sleep
+from tokodaii.bybit.api import API
+from tokodaii.bybit.websocket import WebSocket
+from tokodaii.bybit.utils import api
+from tokodaii.utils import metrics
+
+# Maximum number of topics per subscribe message.
+TOPICS_PER_SUBSCRIBE = 10
+
+def args():
+  parser = argparse.ArgumentParser(prog='bybit_capture', description='Capture raw ByBit websocket messages to a file.')
+  parser.add_argument('channel', metavar='channel', choices=['linear', 'option', 'spot'], help='linear, option, or spot')
+  parser.add_argument('topic', metavar='topic', help='topic prefix, e.g. publicTrade, tickers, orderbook.50')
+  parser.add_argument('symbols', metavar='symbol', nargs='+', help='symbols, or all')
+  parser.add_argument('--o', required=True, help='capture file, appended to if it exists')
+  parser.add_argument('--s', type=float, default=None, help='capture for this many seconds (default: until interrupted)')
+  parser.add_argument('--tn', action=argparse.BooleanOptionalAction, default=False, help='use testnet')
+  parser.add_argument('--v', action=argparse.BooleanOptionalAction, default=False, help='be verbose')
+  parser.add_argument('--m', type=float, default=None, help='dump metrics to stderr every this many seconds')
+  parser.add_argument('--mp', type=int, default=None, help='serve Prometheus metrics on this local port')
+  return parser.parse_args()
+
+if __name__ == '__main__':
+
+  args = args()
+  if args.m is not None or args.mp is not None:
+    metrics.enable()
+    if args.m is not None: metrics.dump_every(args.m)
+    if args.mp is not None: metrics.serve(args.mp)
+  symbols = sorted(api.get_symbols(API(use_testnet=args.tn), args.channel)) if args.symbols == ['all'] else args.symbols
+  topics = [f'{args.topic}.{symbol}' for symbol in symbols]
+  ws = WebSocket(args.channel, use_testnet=args.tn, capture=args.o)
+  assert ws.connected(), 'could not connect'
+  for i in range(0, len(topics), TOPICS_PER_SUBSCRIBE): ws.subscribe(topics[i:i+TOPICS_PER_SUBSCRIBE])
+  if args.v: print(f'capturing {len(topics)} topic(s) to {args.o}')
+  try: sleep(args.s) if args.s is not None else ws.ws_th.join()
+  except KeyboardInterrupt: pass
+  ws.close()
+  if args.v: print(f'captured {ws.capture.n_messages} message(s), {ws.capture.n_bytes} B')
+  if metrics.enabled: print(metrics.to_text())
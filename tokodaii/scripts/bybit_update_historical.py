@@ -1,11 +1,23 @@
 '''
 Update historical data from public.bybit.com.
+
+The update is a pipeline of independently sized stages with bounded queues in
+between, so that memory stays capped: listing the missing dates of all symbols
+(threads), downloading (threads), decompressing, parsing and processing (a
+process pool, since this is CPU bound), and writing (threads). Symbols are
+worked on concurrently; dates are queued as soon as their symbol is listed.
 '''
 
 import argparse
-from concurrent.futures import ThreadPoolExecutor, wait
+import os
+from queue import Queue
+from threading import Thread
+from time import time_ns
+from multiprocessing import get_context
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from tokodaii.bybit.utils import historical
 from tokodaii.data import storage, SUBS, CATEGORIES
+from tokodaii.utils import metrics
 
 def args():
   VALID_CATEGORIES = CATEGORIES['ByBit']['historical']+['all']
@@ -13,26 +25,90 @@ def args():
   parser.add_argument('category', metavar='category', choices=VALID_CATEGORIES, help=', '.join(CATEGORIES['ByBit']['historical'])+', or all')
   parser.add_argument('symbol', metavar='symbol', help='any individual symbol, or all')
   parser.add_argument('--v', action=argparse.BooleanOptionalAction, default=False, help='be verbose')
-  parser.add_argument('--j', type=int, default=4, help='number of threads (default: 4)')
+  parser.add_argument('--j', type=int, default=4, help='number of download threads (default: 4)')
+  parser.add_argument('--p', type=int, default=os.cpu_count(), help=f'number of decode processes (default: {os.cpu_count()})')
+  parser.add_argument('--w', type=int, default=2, help='number of write threads (default: 2)')
+  parser.add_argument('--q', type=int, default=8, help='capacity of each queue between stages (default: 8)')
+  parser.add_argument('--m', type=float, default=None, help='dump metrics to stderr every this many seconds')
+  parser.add_argument('--mp', type=int, default=None, help='serve Prometheus metrics on this local port')
   return parser.parse_args()
 
-def update(category:str, symbol:str, n_threads:int=1, verbose:bool=False):
-  sub = SUBS['ByBit']['historical']
-  for category in CATEGORIES['ByBit']['historical'] if category == 'all' else [category]:
-    for symbol in historical.read_symbols(category) if symbol == 'all' else [symbol]:
-      dates_bybit = historical.read_dates(category, symbol)
-      dates_local = storage.read_filenames(storage.path(sub, category, symbol), fmt='fea')
-      dates = sorted(list(set(dates_bybit)-set(dates_local)))
-      if verbose: print(f'{category}/{symbol} missing {len(dates)}/{len(dates_bybit)}')
-      def task(date:str):
-        df = historical.get(category, symbol, date)
-        historical.process(df, category)
-        storage.write_feather(storage.path(SUBS['ByBit']['historical'], category, symbol, f'{date}.fea'), df)
-        if verbose: print(f'got {category}/{symbol}/{date}')
-      with ThreadPoolExecutor(n_threads) as tpe: wait([tpe.submit(task, date) for date in dates])
+def missing_dates(category:str, symbol:str) -> tuple[list[str], int]:
+  dates_bybit = historical.read_dates(category, symbol)
+  dates_local = storage.read_filenames(storage.path(SUBS['ByBit']['historical'], category, symbol), fmt='fea')
+  return sorted(list(set(dates_bybit)-set(dates_local))), len(dates_bybit)
+
+def update(category:str, symbol:str, n_threads:int=1, n_processes:int=1, n_writers:int=1, queue_size:int=8, verbose:bool=False):
+  # Each queue item is a task (category, symbol, date, start time) with a
+  # payload, the stages pass on `None` to stop.
+  to_download, to_decode, to_write = Queue(queue_size), Queue(queue_size), Queue(queue_size)
+  failed = []
+
+  def fail(task, e):
+    failed.append(task[:3])
+    metrics.add_span('historical_task', task[3], time_ns(), error=True, category=task[0], symbol=task[1], date=task[2])
+    print(f'failed {"/".join(task[:3])}: {e!r}')
+
+  def list_dates():
+    categories = CATEGORIES['ByBit']['historical'] if category == 'all' else [category]
+    with ThreadPoolExecutor(n_threads) as tpe:
+      futures = {tpe.submit(missing_dates, c, s):(c, s) for c in categories for s in (historical.read_symbols(c) if symbol == 'all' else [symbol])}
+      for future in as_completed(futures):
+        c, s = futures[future]
+        dates, n_dates = future.result()
+        if verbose: print(f'{c}/{s} missing {len(dates)}/{n_dates}')
+        for date in dates: to_download.put((c, s, date)) # blocks while downloads are behind
+
+  def download():
+    while (task := to_download.get()) is not None:
+      task += (time_ns(),)
+      try: to_decode.put((task, historical.download(*task[:3])))
+      except Exception as e: fail(task, e)
+
+  def decode(ppe:ProcessPoolExecutor):
+    # Submitting only as fast as the writers take results caps the number of
+    # decoded dataframes in memory.
+    while (item := to_decode.get()) is not None:
+      task, data = item
+      try: to_write.put((task, ppe.submit(historical.decode_and_process, data, task[0])))
+      except Exception as e: fail(task, e)
+
+  def write():
+    while (item := to_write.get()) is not None:
+      task, future = item
+      try:
+        df, decode_s, process_s = future.result()
+        metrics.observe('historical_decode_s', decode_s)
+        metrics.observe('historical_process_s', process_s)
+        storage.write_feather(storage.path(SUBS['ByBit']['historical'], *task[:2], f'{task[2]}.fea'), df)
+        metrics.add_span('historical_task', task[3], time_ns(), category=task[0], symbol=task[1], date=task[2])
+        if verbose: print(f'got {"/".join(task[:3])}')
+      except Exception as e: fail(task, e)
+
+  def start(target, n:int, *args) -> list[Thread]:
+    threads = [Thread(target=target, args=args, daemon=True) for _ in range(n)]
+    for thread in threads: thread.start()
+    return threads
+
+  with ProcessPoolExecutor(n_processes, mp_context=get_context('spawn')) as ppe:
+    writers = start(write, n_writers)
+    decoder = start(decode, 1, ppe)
+    downloaders = start(download, n_threads)
+    try: list_dates()
+    finally:
+      # Shut the stages down in order, each once the previous one has finished.
+      for stage, queue, n in ((downloaders, to_download, n_threads), (decoder, to_decode, 1), (writers, to_write, n_writers)):
+        for _ in range(n): queue.put(None)
+        for thread in stage: thread.join()
+  if failed: print(f'{len(failed)} date(s) failed')
 
 if __name__ == '__main__':
 
   args = args()
+  if args.m is not None or args.mp is not None:
+    metrics.enable()
+    if args.m is not None: metrics.dump_every(args.m)
+    if args.mp is not None: metrics.serve(args.mp)
   if args.category == 'all': assert args.symbol == 'all'
-  update(args.category, args.symbol, args.j, args.v)
+  update(args.category, args.symbol, args.j, args.p, args.w, args.q, args.v)
+  if metrics.enabled: print(metrics.to_text())
@@ -10,13 +10,12 @@ Limitations:
 '''
 
 import argparse
-from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt, timedelta as td
-import numpy as np
 from tokodaii.bybit.api import API
 from tokodaii.bybit.utils import kline_api, api, DT_EARLIEST, CANDLES_PER_CALL
 from tokodaii.data import storage, SUBS, KLINE_CATEGORIES
-from tokodaii.utils import dataframe, time
+from tokodaii.utils import dataframe, time, metrics
 
 CANDLES_PER_THREAD = 10**4 # multiple days
 
@@ -29,6 +28,9 @@ def args():
   parser.add_argument('--tn', action=argparse.BooleanOptionalAction, default=False, help='use testnet')
   parser.add_argument('--v', action=argparse.BooleanOptionalAction, default=False, help='be verbose')
   parser.add_argument('--j', type=int, default=16, help='number of threads (default: 16)')
+  parser.add_argument('--f', action=argparse.BooleanOptionalAction, default=False, help='calibrate the rate limit with the limits ByBit reports; endpoints that don\'t report them run on the static limits with no tolerance, i.e. exactly at the documented limit')
+  parser.add_argument('--m', type=float, default=None, help='dump metrics to stderr every this many seconds')
+  parser.add_argument('--mp', type=int, default=None, help='serve Prometheus metrics on this local port')
   return parser.parse_args()
 
 def get_earliest(sub:str, category:str, symbols:set[str], now:dt, n_threads:int=1, verbose:bool=False) -> dict[str, dt]:
@@ -60,24 +62,27 @@ def create_tasks(earliest:dict[str, dt], now:dt, candles_per_thread:int) -> list
 
 def execute_tasks(api:API, sub:str, category:str, tasks:list[tuple[str, dt, dt]], n_threads:int=1, verbose:bool=False):
   def task(symbol:str, start:dt, end:dt): # [start, end)
-    df = kline_api.from_api(np.concatenate(
-      [np.array(kline_api.get_raw(api, category, symbol, start+td(minutes=i*CANDLES_PER_CALL)))[::-1]
-      for i in range(-((end-start)//td(minutes=-CANDLES_PER_CALL)))]))
-    kline_api.process(df, flip=False)
-    first = time.from_unix_ns(df['start time'][0])
-    offset = (first-start)//td(minutes=1)
-    end_first = 24*60-offset
-    df_day = dataframe.empty_like(df)
-    for col in df.keys(): df_day[col] = df[col][:end_first]
-    storage.write_feather(storage.path(sub, category, symbol, f'{time.dt_to_str_date(start)}.fea'), df_day)
-    for i in range(1, (end-start)//td(days=1)):
-      for col in df.keys(): df_day[col] = df[col][end_first+24*60*(i-1):end_first+24*60*i]
-      storage.write_feather(storage.path(sub, category, symbol, f'{time.dt_to_str_date(start+td(days=i))}.fea'), df_day)
+    with metrics.span('kline_task', category=category, symbol=symbol, start=time.dt_to_str_date_hm(start), end=time.dt_to_str_date_hm(end)):
+      df = kline_api.from_api(
+        [row for i in range(-((end-start)//td(minutes=-CANDLES_PER_CALL)))
+        for row in kline_api.get_raw(api, category, symbol, start+td(minutes=i*CANDLES_PER_CALL))[::-1]], flip=False)
+      first = time.from_unix_ns(df['start time'][0])
+      offset = (first-start)//td(minutes=1)
+      end_first = 24*60-offset
+      df_day = dataframe.empty_like(df)
+      for col in df.keys(): df_day[col] = df[col][:end_first]
+      storage.write_feather(storage.path(sub, category, symbol, f'{time.dt_to_str_date(start)}.fea'), df_day)
+      for i in range(1, (end-start)//td(days=1)):
+        for col in df.keys(): df_day[col] = df[col][end_first+24*60*(i-1):end_first+24*60*i]
+        storage.write_feather(storage.path(sub, category, symbol, f'{time.dt_to_str_date(start+td(days=i))}.fea'), df_day)
     if verbose: print(f'completed {symbol} [{time.dt_to_str_date_hm(start)}, {time.dt_to_str_date_hm(end)})')
   if n_threads == 1:
     for t in tasks: task(*t)
   else:
-    with ThreadPoolExecutor(n_threads) as tpe: wait([tpe.submit(task, *t) for t in tasks])
+    # Collect the results, so a failed task raises instead of its days going
+    # missing silently.
+    with ThreadPoolExecutor(n_threads) as tpe:
+      for future in [tpe.submit(task, *t) for t in tasks]: future.result()
 
 def update(api_:API, category:str, symbol:str, now:dt, n_threads, verbose):
   sub = SUBS[api_.exchange]['API_kline']
@@ -94,9 +99,14 @@ def update(api_:API, category:str, symbol:str, now:dt, n_threads, verbose):
 if __name__ == '__main__':
 
   args = args()
+  if args.m is not None or args.mp is not None:
+    metrics.enable()
+    if args.m is not None: metrics.dump_every(args.m)
+    if args.mp is not None: metrics.serve(args.mp)
   if args.category == 'all': assert args.symbol == 'all'
-  api_ = API(use_testnet=args.tn)
+  api_ = API(use_testnet=args.tn, feedback=args.f)
 
   now = api.get_time(api_)
   if args.v: print(f'server time {time.dt_to_str_date_hms_us(now)}')
   update(api_, args.category, args.symbol, now, args.j, args.v)
+  if metrics.enabled: print(metrics.to_text())
@@ -0,0 +1,68 @@
+'''
+Check that importing tokodaii modules stays within an import time budget and
+has no side effects. Each module is imported in a fresh interpreter with a
+temporary home directory, which must still be empty afterwards. Exits with a
+nonzero status if any module fails.
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+# Cumulative import time budgets in ms, as reported by `python -X importtime`.
+# numpy is allowed everywhere, and requests where the network is used, but
+# pandas, pyarrow, matplotlib and torch must not be imported at module load.
+BUDGETS_MS = {
+  'tokodaii':5,
+  'tokodaii.config':10,
+  'tokodaii.utils.time':20,
+  'tokodaii.utils.rounding':5,
+  'tokodaii.utils.metrics':30,
+  'tokodaii.utils.dataframe':120,
+  'tokodaii.data.storage':150,
+  'tokodaii.data.utils.kline':150,
+  'tokodaii.auto.guard':150,
+  'tokodaii.bybit.api':250,
+  'tokodaii.bybit.websocket':250,
+  'tokodaii.bybit.utils.historical':300,
+  'tokodaii.bybit.utils.kline_api':300}
+HEAVY = ['pandas', 'pyarrow', 'matplotlib', 'torch']
+
+def args():
+  parser = argparse.ArgumentParser(prog='check_import_time', description='Check import times and side effects of tokodaii modules.')
+  parser.add_argument('--r', type=int, default=3, help='repetitions per module, the best is kept (default: 3)')
+  parser.add_argument('--s', type=float, default=1, help='scale all budgets by this factor (default: 1)')
+  return parser.parse_args()
+
+'''
+Returns the best cumulative import time in ms of `module`, the heavy modules it
+imported, and whether the home directory was touched.
+'''
+def measure(module:str, repetitions:int=3) -> tuple[float, set[str], bool]:
+  best, heavy, touched = float('inf'), set(), False
+  for _ in range(repetitions):
+    with tempfile.TemporaryDirectory() as home:
+      env = os.environ | {'HOME':home, 'USERPROFILE':home}
+      result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], env=env, capture_output=True, text=True, check=True)
+      touched |= len(os.listdir(home)) != 0
+    times = {}
+    for line in result.stderr.splitlines():
+      if not line.startswith('import time:') or 'cumulative' in line: continue
+      _, cumulative, name = line[len('import time:'):].split('|')
+      times[name.strip()] = int(cumulative)
+    best = min(best, times[module]/10**3)
+    heavy |= {m for m in HEAVY if m in times}
+  return best, heavy, touched
+
+if __name__ == '__main__':
+
+  args = args()
+  failed = False
+  for module, budget in BUDGETS_MS.items():
+    ms, heavy, touched = measure(module, args.r)
+    ok = ms <= budget*args.s and not heavy and not touched
+    failed |= not ok
+    print(f'{"ok  " if ok else "FAIL"} {module} {ms:.1f}/{budget*args.s:.0f} ms'+(f' imports {", ".join(sorted(heavy))}' if heavy else '')+(' touches home' if touched else ''))
+  sys.exit(failed)
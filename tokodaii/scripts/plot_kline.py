@@ -1,44 +1,58 @@
 '''
-Use local kline data to make basic kline plots.
+Use local kline or trade data to make basic plots. The data is streamed day by
+day through M4 decimation, with `N` buckets over the range, so any range, from
+a few hours of ticks to years of kline, plots in bounded time and memory.
 '''
 
 import argparse
 from datetime import timedelta as td
-import matplotlib.pyplot as plt
-from matplotlib.dates import DateFormatter
-from tokodaii.data.utils import kline
-from tokodaii.utils import time, rounding
-from tokodaii.data import KLINE_SOURCES, KLINE_CATEGORIES, EXCHANGES
+from tokodaii.data.utils import kline, trade
+from tokodaii.utils import time
+from tokodaii.utils.decimate import M4
+from tokodaii.data import KLINE_SOURCES, KLINE_CATEGORIES, EXCHANGES, DATA_TYPES
 
 N = 4096
 
 def args():
-  parser = argparse.ArgumentParser(prog='plot_kline', description='Plot locally stored kline data.')
+  parser = argparse.ArgumentParser(prog='plot_kline', description='Plot locally stored kline or trade data.')
   parser.add_argument('exchange', metavar='exchange', choices=EXCHANGES, help=f'exchange in {EXCHANGES}')
-  parser.add_argument('source', metavar='source', help=f'source in {KLINE_SOURCES}')
-  parser.add_argument('category', metavar='category', help=f'category in {KLINE_CATEGORIES}')
+  parser.add_argument('source', metavar='source', help=f'source in {KLINE_SOURCES}, or historical for trades')
+  parser.add_argument('category', metavar='category', help=f'category in {KLINE_CATEGORIES}, or trading for trades')
   parser.add_argument('symbol', metavar='symbol')
   parser.add_argument('start', metavar='start', help='start date (yyyy-mm-dd) (inclusive)')
   parser.add_argument('end', metavar='end', help='end date in (yyyy-mm-dd) (exclusive)')
+  parser.add_argument('--n', type=int, default=N, help=f'number of buckets (default: {N})')
   parser.add_argument('--s', action=argparse.BooleanOptionalAction, default=False, help='save the plot instead')
   return parser.parse_args()
 
 if __name__ == '__main__':
 
   args = args()
+  import matplotlib.pyplot as plt
+  from matplotlib.dates import DateFormatter
   exchange, source, category, symbol = args.exchange, args.source, args.category, args.symbol
   start, end, s = args.start, args.end, args.s
 
   start, end = time.from_str_date(start), time.from_str_date(end)
-  step = rounding.up((end-start)/N, td(minutes=1))
-  df = kline.get(exchange, source, category, symbol, start, end, step)
-  times = df['start time'].astype('datetime64[ns]')
+  m4 = M4(time.unix_ns(start), time.unix_ns(end), args.n)
+  if DATA_TYPES[exchange][source][category] == 'trade':
+    label = 'price'
+    # The side is encoded in the sign of the price.
+    for df in trade.get_days(exchange, symbol, start, end, columns=['price']):
+      m4.update(df['time'], abs(df['price']))
+  else:
+    label = 'hi-lo avg'
+    # Only the midpoint, so the line is the same as without decimation.
+    for df in kline.get_days(exchange, source, category, symbol, start, end, columns=['high price', 'low price']):
+      m4.update(df['start time'], (df['high price']+df['low price'])/2)
+  times, values = m4.result()
+  times = times.astype('datetime64[ns]')
   date_fmt = time.FMT_date_hm if end-start < td(days=5) else time.FMT_date
 
   plt.rcParams['figure.figsize'] = (10, 5)
   plt.gca().xaxis.set_major_formatter(DateFormatter(date_fmt))
   plt.gcf().autofmt_xdate()
-  plt.plot(times, (df['high price']+df['low price'])/2, c='black', label='hi-lo avg')
+  plt.plot(times, values, c='black', lw=.5, label=label)
   plt.xlim(times[0], times[-1])
   plt.ylabel(symbol, size=18)
   plt.grid()
@@ -4,7 +4,6 @@ Rewrite local data as Excel files to be human readable, for convenience.
 
 import os
 import argparse
-import pandas as pd
 from tokodaii.data import storage, SOURCES, CATEGORIES, SUBS, EXCHANGES
 
 def args():
@@ -19,7 +18,8 @@ def args():
 if __name__ == '__main__':
 
   args = args()
+  import pandas as pd
   exchange, source, category, symbol, date = args.exchange, args.source, args.category, args.symbol, args.date
 
   path = storage.path(SUBS[exchange][source], category, symbol, f'{date}.fea')
-  pd.read_feather(path).to_excel(f'{exchange}_{source}_{category}_{symbol}_{args.date}.xlsx')
+  pd.DataFrame(storage.read_feather(path)).to_excel(f'{exchange}_{source}_{category}_{symbol}_{args.date}.xlsx')
@@ -0,0 +1,51 @@
+'''
+Conversion kernels that turn raw columns into their final types in as few
+passes, and with as few full size temporaries, as possible. Where the input is
+a freshly parsed column nobody else holds, it's reused as scratch space.
+'''
+
+import numpy as np
+
+'''
+Unix timestamps in seconds to exact integer ns. Integer input is simply scaled.
+Float input is assumed to have at most `decimals` decimals, and is rounded to
+that resolution before the cast, which is exact for `decimals` <= 6 up to the
+year 2255, unlike a truncating cast of `x*10**3` or `x*10**9`. A float64 `x` is
+overwritten if `inplace`.
+'''
+def s_to_ns(x:np.ndarray, decimals:int=6, inplace:bool=False) -> np.ndarray:
+  if x.dtype.kind in 'iu':
+    ret = x.astype('int64')
+    ret *= 10**9
+    return ret
+  out = x if inplace and x.dtype == np.float64 and x.flags.writeable else None
+  x = np.multiply(x, 10**decimals, out=out, dtype=np.float64)
+  np.rint(x, out=x)
+  ret = x.astype('int64')
+  ret *= 10**(9-decimals)
+  return ret
+
+'''
+`x` as `dtype`, negated where `negative`. If `x` is already of `dtype` and
+writable it's negated in place.
+'''
+def signed(x:np.ndarray, negative:np.ndarray, dtype='float32') -> np.ndarray:
+  x = x.astype(dtype, copy=not x.flags.writeable)
+  np.negative(x, out=x, where=negative)
+  return x
+
+'''
+Rows of numeric strings, as returned by JSON APIs, straight to typed columns.
+The strings are parsed once, in C, into a single column major float64 buffer,
+which is exact for integer columns up to 2**53. Each column is then cast (and
+optionally flipped) in one pass. `scale` multiplies integer columns after the
+cast, e.g. ms to ns.
+'''
+def rows_to_columns(rows:list[list[str]], col_type:dict[str, str], flip:bool=False, scale:dict[str, int]={}) -> dict[str, np.ndarray]:
+  data = np.array(rows, dtype=np.float64, order='F').reshape((len(rows), len(col_type)))
+  if flip: data = data[::-1]
+  ret = {}
+  for i, (col, type_) in enumerate(col_type.items()):
+    ret[col] = data[:,i].astype(type_, order='C')
+    if col in scale: ret[col] *= scale[col]
+  return ret
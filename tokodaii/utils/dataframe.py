@@ -1,20 +1,24 @@
 from typing import Any
 from pathlib import Path
 import numpy as np
-import pandas as pd
-import pyarrow.feather as feather
-import pyarrow as pa
 
-def from_pd(df:pd.DataFrame) -> dict[str, np.ndarray]:
+# pandas and pyarrow are imported where they're used, they take most of the
+# import time and much of the package doesn't need them.
+
+def from_pd(df:'pandas.DataFrame') -> dict[str, np.ndarray]:
   return {col:df[col].to_numpy() for col in df.columns}
 
 def from_csv(*args, **kwargs) -> dict[str, np.ndarray]:
+  import pandas as pd
   return from_pd(pd.read_csv(*args, **kwargs))
 
 def from_feather(filename:Path, *args, **kwargs) -> dict[str, np.ndarray]:
+  import pyarrow.feather as feather
   return from_pd(feather.read_feather(filename, *args, **kwargs))
 
 def to_feather(filename:Path, df:dict[str, Any], *args, **kwargs):
+  import pyarrow.feather as feather
+  import pyarrow as pa
   feather.write_feather(pa.table(df), filename, *args, **kwargs)
 
 def rename(df:dict[str, Any], from_to: dict[str, str]):
@@ -39,3 +43,91 @@ def is_empty(df:dict[str, Any], check_all:bool=False):
   for col in df.keys():
     if df[col]: return False
   return True
+
+def cut(df:dict[str, np.ndarray], start:int=None, end:int=None) -> dict[str, np.ndarray]:
+  return {col:df[col][start:end] for col in df.keys()}
+
+'''
+As-of indices: for each time in `left`, the index of the last time in `right`
+at or before it (strictly before if not `inclusive`), or -1 if there is none,
+or if it's more than `tolerance` older. Both must be sorted.
+'''
+def asof_indices(left:np.ndarray, right:np.ndarray, tolerance:int=None, inclusive:bool=True) -> np.ndarray:
+  i = np.searchsorted(right, left, side='right' if inclusive else 'left')-1
+  if tolerance is not None and len(right):
+    i[left-right[np.maximum(i, 0)] > tolerance] = -1
+  return i
+
+'''
+Gather `x` at indices `i`, with `fill` where `i` is -1. Integer columns are
+upcast to float if `fill` is nan.
+'''
+def take(x:np.ndarray, i:np.ndarray, fill=np.nan) -> np.ndarray:
+  missing = i < 0
+  ret = x[np.maximum(i, 0)] if len(x) else np.zeros(len(i), dtype=x.dtype)
+  if missing.any():
+    ret = ret.astype(np.result_type(ret.dtype, np.min_scalar_type(fill)), copy=False)
+    ret[missing] = fill
+  return ret
+
+'''
+As-of join of `right` onto `left`: every row of `left` gets the columns of the
+last row of `right` at or before it. The time columns are `on` in `left` and
+`right_on` (`on` by default) in `right`; the latter is not copied. Right
+columns get `suffix` appended.
+'''
+def asof_join(left:dict[str, np.ndarray], right:dict[str, np.ndarray], on:str='start time', right_on:str=None, tolerance:int=None, suffix:str='', fill=np.nan) -> dict[str, np.ndarray]:
+  right_on = right_on or on
+  i = asof_indices(left[on], right[right_on], tolerance)
+  return dict(left) | {col+suffix:take(right[col], i, fill) for col in right.keys() if col != right_on}
+
+'''
+Range indices: for sorted times `t` and bins [`starts`, `ends`), the index
+ranges [`lo`, `hi`) of `t` in each bin.
+'''
+def range_indices(t:np.ndarray, starts:np.ndarray, ends:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  return np.searchsorted(t, starts, side='left'), np.searchsorted(t, ends, side='left')
+
+'''
+Sum of `x` over each range [`lo`, `hi`), through a float64 running sum.
+'''
+def range_sum(x:np.ndarray, lo:np.ndarray, hi:np.ndarray) -> np.ndarray:
+  cs = np.zeros(len(x)+1)
+  np.cumsum(x, out=cs[1:])
+  return cs[hi]-cs[lo]
+
+'''
+Reduce `x` over each range [`lo`, `hi`) with a ufunc such as `np.maximum`, in a
+single `reduceat`. Ranges must be sorted and not overlap. Empty ranges get
+`empty`.
+'''
+def range_reduce(x:np.ndarray, lo:np.ndarray, hi:np.ndarray, ufunc=np.maximum, empty=np.nan) -> np.ndarray:
+  if len(lo) == 0: return np.array([], dtype=x.dtype)
+  idx = np.empty(2*len(lo), dtype=np.intp)
+  idx[0::2], idx[1::2] = lo, hi
+  # A sentinel so that indices equal to len(x) are valid.
+  ret = ufunc.reduceat(np.concatenate([x, x[:1] if len(x) else np.zeros(1, x.dtype)]), idx)[0::2]
+  return np.where(hi > lo, ret, empty)
+
+'''
+Join a stream of chunks of `right` onto a stream of chunks of `left`, as
+`asof_join` would on the concatenations, e.g. day file by day file. Both streams
+must be chronological. Only the part of `right` still needed is kept, so memory
+scales with the chunk sizes, not with the range.
+'''
+def asof_join_chunks(left_chunks, right_chunks, on:str='start time', right_on:str=None, tolerance:int=None, suffix:str='', fill=np.nan):
+  right_on = right_on or on
+  right_chunks = iter(right_chunks)
+  right, exhausted = None, False
+  for left in left_chunks:
+    if len(left[on]) == 0: continue
+    while not exhausted and (right is None or len(right[right_on]) == 0 or right[right_on][-1] < left[on][-1]):
+      if (new := next(right_chunks, None)) is None: exhausted = True
+      else: right = new if right is None else concat([right, new])
+    if right is None:
+      yield dict(left)
+      continue
+    yield asof_join(left, right, on, right_on, tolerance, suffix, fill)
+    # Only the last row at or before the end of this chunk, and anything after,
+    # can still be matched.
+    right = cut(right, max(np.searchsorted(right[right_on], left[on][-1], side='right')-1, 0))
@@ -0,0 +1,76 @@
+'''
+Min/max preserving decimation for plotting, after the M4 algorithm: the time
+range is split into one bucket per pixel column, and per bucket only the first,
+last, minimum and maximum points are kept. A line through those points renders
+the same as a line through all of them, so data of any size plots in bounded
+time and memory, without aliasing. Data can be fed in chronological chunks.
+'''
+
+import numpy as np
+
+class M4():
+
+  '''
+  Buckets of equal integer width cover [`t0`, `t1`), times are usually in ns.
+  '''
+  def __init__(self, t0:int, t1:int, n:int):
+    self.t0, self.t1, self.n = t0, t1, n
+    self.width = max(-(-(t1-t0)//n), 1)
+    self.seen = np.zeros(n, dtype=bool)
+    self.first_t, self.last_t, self.min_t, self.max_t = (np.zeros(n, dtype=np.int64) for _ in range(4))
+    self.first_v, self.last_v, self.min_v, self.max_v = (np.zeros(n, dtype=np.float64) for _ in range(4))
+
+  '''
+  Add a chronological chunk of points (`t`, `v`). If given, `lo` and `hi` are
+  used for the minima and maxima instead of `v`, e.g. the low and high price of
+  kline, with `v` the close. nan values are ignored.
+  '''
+  def update(self, t:np.ndarray, v:np.ndarray, lo:np.ndarray=None, hi:np.ndarray=None):
+    lo = v if lo is None else lo
+    hi = v if hi is None else hi
+    i0, i1 = np.searchsorted(t, self.t0, side='left'), np.searchsorted(t, self.t1, side='left')
+    t, v, lo, hi = t[i0:i1], v[i0:i1], lo[i0:i1], hi[i0:i1]
+    if np.isnan(v).any() or np.isnan(lo).any() or np.isnan(hi).any():
+      keep = ~(np.isnan(v) | np.isnan(lo) | np.isnan(hi))
+      t, v, lo, hi = t[keep], v[keep], lo[keep], hi[keep]
+    if len(t) == 0: return
+    b = (t-self.t0)//self.width
+    starts = np.flatnonzero(np.concatenate([[True], b[1:] != b[:-1]]))
+    ends = np.append(starts[1:], len(t))
+    buckets = b[starts]
+    i_min, i_max = _arg_reduce(lo, starts, ends, np.minimum), _arg_reduce(hi, starts, ends, np.maximum)
+    # Buckets seen in an earlier chunk keep their first point, and their extrema
+    # unless beaten.
+    new = ~self.seen[buckets]
+    self.first_t[buckets[new]], self.first_v[buckets[new]] = t[starts[new]], v[starts[new]]
+    self.last_t[buckets], self.last_v[buckets] = t[ends-1], v[ends-1]
+    replace = new | (lo[i_min] < self.min_v[buckets])
+    self.min_t[buckets[replace]], self.min_v[buckets[replace]] = t[i_min[replace]], lo[i_min[replace]]
+    replace = new | (hi[i_max] > self.max_v[buckets])
+    self.max_t[buckets[replace]], self.max_v[buckets[replace]] = t[i_max[replace]], hi[i_max[replace]]
+    self.seen[buckets] = True
+
+  '''
+  The decimated points (`t`, `v`), chronological, at most 4 per bucket.
+  '''
+  def result(self) -> tuple[np.ndarray, np.ndarray]:
+    s = self.seen
+    t = np.concatenate([self.first_t[s], self.min_t[s], self.max_t[s], self.last_t[s]])
+    v = np.concatenate([self.first_v[s], self.min_v[s], self.max_v[s], self.last_v[s]])
+    # Within equal times, first comes first and last comes last.
+    rank = np.repeat(np.arange(4), s.sum())
+    i = np.lexsort((rank, t))
+    t, v = t[i], v[i]
+    keep = np.concatenate([[True], (t[1:] != t[:-1]) | (v[1:] != v[:-1])])
+    return t[keep], v[keep]
+
+'''
+Index of the first minimum (or maximum, by `ufunc`) of `x` in each group
+[`starts`, `ends`).
+'''
+def _arg_reduce(x:np.ndarray, starts:np.ndarray, ends:np.ndarray, ufunc) -> np.ndarray:
+  extreme = np.repeat(ufunc.reduceat(x, starts), ends-starts)
+  i = np.flatnonzero(x == extreme)
+  group = np.searchsorted(starts, i, side='right')-1
+  first = np.concatenate([[True], group[1:] != group[:-1]])
+  return i[first]
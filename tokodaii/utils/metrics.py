@@ -0,0 +1,215 @@
+'''
+Low overhead metrics and tracing. Counters, latency histograms, and spans, kept
+in a global registry. Everything is off by default; while `enabled` is false,
+`count`, `timer`, and `span` return immediately, so instrumented code costs a
+global lookup and a branch. The registry can be dumped as text or json,
+periodically, and served in the Prometheus text format on a local port.
+'''
+
+from time import perf_counter_ns, time_ns
+from threading import Lock, Thread, Event
+from collections import deque
+import json
+import sys
+
+enabled = False
+
+# Histogram bucket upper bounds in seconds, roughly 3 per decade from 1 us to
+# 100 s. The last bucket is implicitly +inf.
+BUCKETS = [float(f'{a}e{e}') for e in range(-6, 2) for a in (1, 2.5, 5)]+[100.]
+# Number of finished spans kept for tracing.
+SPANS_MAXLEN = 4096
+
+counters:dict = {}
+histograms:dict = {}
+spans = deque(maxlen=SPANS_MAXLEN)
+_lock = Lock()
+
+def enable(on:bool=True):
+  global enabled
+  enabled = on
+
+class Counter():
+
+  def __init__(self, name:str):
+    self.name = name
+    self.value = 0
+    self.lock = Lock()
+
+  def add(self, n=1):
+    with self.lock: self.value += n
+
+class Histogram():
+
+  def __init__(self, name:str):
+    self.name = name
+    self.counts = [0]*(len(BUCKETS)+1)
+    self.sum = 0.
+    self.count = 0
+    self.lock = Lock()
+
+  def observe(self, x:float):
+    # Linear search is fine, most observations land in the first few buckets.
+    i = 0
+    while i < len(BUCKETS) and x > BUCKETS[i]: i += 1
+    with self.lock:
+      self.counts[i] += 1
+      self.sum += x
+      self.count += 1
+
+def counter(name:str) -> Counter:
+  if (c := counters.get(name)) is None:
+    with _lock: c = counters.setdefault(name, Counter(name))
+  return c
+
+def histogram(name:str) -> Histogram:
+  if (h := histograms.get(name)) is None:
+    with _lock: h = histograms.setdefault(name, Histogram(name))
+  return h
+
+def count(name:str, n=1):
+  if enabled: counter(name).add(n)
+
+def observe(name:str, x:float):
+  if enabled: histogram(name).observe(x)
+
+class _Null():
+  def __enter__(self): return self
+  def __exit__(self, *args): pass
+_null = _Null()
+
+class _Timer():
+
+  def __init__(self, name:str):
+    self.histogram = histogram(name)
+
+  def __enter__(self):
+    self.t0 = perf_counter_ns()
+    return self
+
+  def __exit__(self, *args):
+    self.histogram.observe((perf_counter_ns()-self.t0)/10**9)
+
+class _Span(_Timer):
+
+  def __init__(self, name:str, attrs:dict):
+    super().__init__(f'span_{name}')
+    self.name, self.attrs = name, attrs
+
+  def __enter__(self):
+    self.start_ns = time_ns()
+    return super().__enter__()
+
+  def __exit__(self, *args):
+    duration = (perf_counter_ns()-self.t0)/10**9
+    self.histogram.observe(duration)
+    spans.append({'name':self.name, 'start ns':self.start_ns, 'duration s':duration, 'error':args[0] is not None} | self.attrs)
+
+'''
+Time a block into the histogram `name`, e.g. `with metrics.timer('api_get_s'):`.
+'''
+def timer(name:str):
+  return _Timer(name) if enabled else _null
+
+'''
+Like `timer`, but also records the finished span with its attributes, for
+tracing individual tasks.
+'''
+def span(name:str, **attrs):
+  return _Span(name, attrs) if enabled else _null
+
+'''
+Record a finished span directly, for tasks that don't run within a single
+block, e.g. ones passed between threads. Times are from `time.time_ns`.
+'''
+def add_span(name:str, start_ns:int, end_ns:int, error:bool=False, **attrs):
+  if enabled:
+    histogram(f'span_{name}').observe((end_ns-start_ns)/10**9)
+    spans.append({'name':name, 'start ns':start_ns, 'duration s':(end_ns-start_ns)/10**9, 'error':error} | attrs)
+
+def reset():
+  with _lock:
+    counters.clear()
+    histograms.clear()
+    spans.clear()
+
+def snapshot() -> dict:
+  return {
+    'counters':{c.name:c.value for c in list(counters.values())},
+    'histograms':{h.name:{'buckets':dict(zip([str(b) for b in BUCKETS]+['inf'], h.counts)), 'sum':h.sum, 'count':h.count} for h in list(histograms.values())},
+    'spans':list(spans)}
+
+def to_json(include_spans:bool=False) -> str:
+  ret = snapshot()
+  if not include_spans: del ret['spans']
+  return json.dumps(ret)
+
+def to_text() -> str:
+  lines = []
+  for c in sorted(list(counters.values()), key=lambda c:c.name):
+    lines.append(f'{c.name} {c.value}')
+  for h in sorted(list(histograms.values()), key=lambda h:h.name):
+    mean = h.sum/h.count if h.count else 0
+    lines.append(f'{h.name} n={h.count} sum={h.sum:.6f}s mean={mean:.6f}s p50<={_quantile(h, .5)} p99<={_quantile(h, .99)}')
+  return '\n'.join(lines)
+
+def _quantile(h:Histogram, q:float) -> str:
+  if h.count == 0: return '-'
+  n = 0
+  for b, c in zip(BUCKETS+['inf'], h.counts):
+    n += c
+    if n >= q*h.count: return f'{b}s'
+  return 'inf'
+
+def _prometheus_name(name:str) -> str:
+  return 'tokodaii_'+''.join(c if c.isalnum() else '_' for c in name)
+
+def to_prometheus() -> str:
+  lines = []
+  for c in sorted(list(counters.values()), key=lambda c:c.name):
+    name = _prometheus_name(c.name)
+    lines += [f'# TYPE {name} counter', f'{name} {c.value}']
+  for h in sorted(list(histograms.values()), key=lambda h:h.name):
+    name = _prometheus_name(h.name)
+    lines.append(f'# TYPE {name} histogram')
+    n = 0
+    for b, c in zip(BUCKETS+['+Inf'], h.counts):
+      n += c
+      lines.append(f'{name}_bucket{{le="{b}"}} {n}')
+    lines += [f'{name}_sum {h.sum}', f'{name}_count {h.count}']
+  return '\n'.join(lines)+'\n'
+
+'''
+Periodically write a dump to `fp` (stderr by default) in a daemon thread, as
+'text' or 'json'. Set the returned event to stop.
+'''
+def dump_every(interval_s:float, fp=None, fmt:str='text') -> Event:
+  stop = Event()
+  def task():
+    while not stop.wait(interval_s):
+      print(to_text() if fmt == 'text' else to_json(), file=fp or sys.stderr, flush=True)
+  Thread(target=task, daemon=True).start()
+  return stop
+
+'''
+Serve the registry in the Prometheus text format on
+http://`host`:`port`/metrics, in a daemon thread. Returns the server, call its
+`shutdown` to stop.
+'''
+def serve(port:int=9464, host:str='127.0.0.1'):
+  from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+  class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path.split('?')[0] != '/metrics':
+        self.send_error(404)
+        return
+      body = to_prometheus().encode()
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/plain; version=0.0.4')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+    def log_message(self, *args): pass
+  server = ThreadingHTTPServer((host, port), Handler)
+  Thread(target=server.serve_forever, daemon=True).start()
+  return server